@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+'''
+NAME
+    asciidoc-client - Convert AsciiDoc documents with an asciidoc(1) server
+
+SYNOPSIS
+    asciidoc-client [OPTIONS] FILE
+
+DESCRIPTION
+    A drop-in replacement for the asciidoc(1) command that sends the
+    conversion request to an asciidoc(1) server started with:
+
+        asciidoc --serve=SOCKET
+
+    The server's Unix domain socket is set by the ASCIIDOC_SOCKET
+    environment variable. The options, output, messages and exit status are
+    the same as asciidoc(1). If ASCIIDOC_SOCKET is not set or the server is
+    not running, or if the server reports that the options must be run
+    locally, then asciidoc(1) is run instead. Documents are converted in
+    safe mode unless the server was started with the --unsafe option.
+
+ENVIRONMENT
+    ASCIIDOC_SOCKET
+        The asciidoc(1) server socket file name.
+
+SEE ALSO
+    asciidoc(1)
+
+COPYING
+    Free use of this software is granted under the terms of the GNU General
+    Public License (GPL).
+'''
+
+import os, sys, socket
+
+def asciidoc(args, input=None):
+    '''Run asciidoc(1) locally and exit. 'input' is the standard input if
+    it has already been read.'''
+    asciidoc_py = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                               'asciidoc.py')
+    cmd = [sys.executable, asciidoc_py] + args
+    if input is None:
+        os.execv(cmd[0], cmd)
+    import subprocess
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    p.communicate(input)
+    sys.exit(p.returncode)
+
+def convert(path, request):
+    '''Send conversion request to the server, return the decoded response
+    or None if the server is not running or the request must be run
+    locally.'''
+    import json
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            s.connect(path)
+        except socket.error:
+            return None
+        # Byte strings are sent as Latin-1 JSON strings.
+        s.sendall(json.dumps(request, encoding='latin-1'))
+        s.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            data = s.recv(65536)
+            if not data:
+                break
+            chunks.append(data)
+    finally:
+        s.close()
+    response = json.loads(''.join(chunks))
+    if response.get('local'):
+        return None
+    for k in ('output','stderr'):
+        response[k] = response[k].encode('latin-1')
+    return response
+
+def main():
+    args = sys.argv[1:]
+    path = os.environ.get('ASCIIDOC_SOCKET')
+    if not path:
+        asciidoc(args)
+    request = {'args': args, 'cwd': os.getcwd(), 'input': None}
+    if args and args[-1] == '-':
+        request['input'] = sys.stdin.read()
+    response = convert(path, request)
+    if response is None:
+        asciidoc(args, request['input'])
+    sys.stdout.write(response['output'])
+    sys.stderr.write(response['stderr'])
+    sys.exit(response['status'])
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
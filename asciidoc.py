@@ -7,11 +7,13 @@ under the terms of the GNU General Public License (GPL).
 """
 
 import sys, os, re, time, traceback, tempfile, subprocess, codecs, locale, unicodedata, copy
+import base64, mimetypes, shlex, itertools
+from keyword import iskeyword
 
 ### Used by asciidocapi.py ###
 VERSION = '8.6.9'           # See CHANGLOG file for version history.
 
-MIN_PYTHON_VERSION = '2.4'  # Require this version of Python or better.
+MIN_PYTHON_VERSION = '2.6'  # Require this version of Python or better.
 
 #---------------------------------------------------------------------------
 # Program constants.
@@ -125,43 +127,110 @@ class InsensitiveDict(dict):
     def setdefault(self, key, default = None):
         return dict.setdefault(self, key.lower(), default)
 
+class LRUCache:
+    """
+    Bounded least recently used cache. Approximated with two generations:
+    when the current generation is full it replaces the previous one; keys
+    found in the previous generation are promoted to the current one.
+    """
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.clear()
+    def clear(self):
+        self.current = {}
+        self.previous = {}
+    def get(self, key, default=None):
+        if key in self.current:
+            return self.current[key]
+        if key in self.previous:
+            value = self.previous[key]
+            self.put(key, value)
+            return value
+        return default
+    def put(self, key, value):
+        if len(self.current) >= self.maxsize:
+            self.previous = self.current
+            self.current = {}
+        self.current[key] = value
+
 
 class Trace(object):
     """
     Used in conjunction with the 'trace' attribute to generate diagnostic
-    output. There is a single global instance of this class named trace.
+    trace events. Tracing is active while the document 'trace' attribute is
+    defined: update() is called whenever the attribute can change and call
+    sites check the 'active' flag before building the event arguments, so
+    tracing costs nothing when it is off. Each event is a dictionary with
+    'name', 'file', 'line', 'before' and 'after' items which is passed to
+    the 'callback' function if it is set, else appended as a JSON line to
+    the 'trace-file' attribute file if it is defined, else printed to
+    stderr. There is a single global instance of this class named trace.
     """
     SUBS_NAMES = ('specialcharacters','quotes','specialwords',
                   'replacements', 'attributes','macros','callouts',
                   'replacements2','replacements3')
     def __init__(self):
-        self.name_re = ''        # Regexp pattern to match trace names.
+        self.active = False      # True if the 'trace' attribute is defined.
+        self.name_re = None      # Compiled 'trace' attribute regexp.
+        self.pattern = None      # 'trace' attribute value.
+        self.callback = None     # Trace event handler function (API use).
+        self.f = None            # 'trace-file' file object.
+        self.fname = None        # 'trace-file' file name.
         self.linenos = True
         self.offset = 0
+    def update(self):
+        """Activate or deactivate tracing from the 'trace' attribute."""
+        pattern = document.attributes.get('trace')
+        if pattern == 'subs':    # Alias for all the inline substitutions.
+            pattern = '|'.join(self.SUBS_NAMES)
+        if pattern != self.pattern:
+            self.pattern = pattern
+            if pattern is None:
+                self.name_re = None
+            else:
+                self.name_re = re.compile(pattern)
+        self.active = pattern is not None
     def __call__(self, name, before, after=None):
         """
-        Print trace message if tracing is on and the trace 'name' matches the
+        Emit trace event if tracing is on and the trace 'name' matches the
         document 'trace' attribute (treated as a regexp).
         'before' is the source text before substitution; 'after' text is the
         source text after substitutuion.
-        The 'before' and 'after' messages are only printed if they differ.
+        The event is only emitted if the 'before' and 'after' texts differ.
         """
-        name_re = document.attributes.get('trace')
-        if name_re == 'subs':    # Alias for all the inline substitutions.
-            name_re = '|'.join(self.SUBS_NAMES)
-        self.name_re = name_re
-        if self.name_re is not None:
+        if not self.active or before == after or not self.name_re.match(name):
+            return
+        if is_array(before):
+            before = '\n'.join(before)
+        if is_array(after):
+            after = '\n'.join(after)
+        event = {'name': name, 'file': None, 'line': None,
+                 'before': before, 'after': after}
+        if reader.cursor:
+            event['file'] = reader.cursor[0]
+            event['line'] = reader.cursor[1] + self.offset
+        if self.callback is not None:
+            self.callback(event)
+        elif document.attributes.get('trace-file'):
+            self.write(event, document.attributes['trace-file'])
+        else:
             msg = message.format(name, 'TRACE: ', self.linenos, offset=self.offset)
-            if before != after and re.match(self.name_re,name):
-                if is_array(before):
-                    before = '\n'.join(before)
-                if after is None:
-                    msg += '\n%s\n' % before
-                else:
-                    if is_array(after):
-                        after = '\n'.join(after)
-                    msg += '\n<<<\n%s\n>>>\n%s\n' % (before,after)
-                message.stderr(msg)
+            if after is None:
+                msg += '\n%s\n' % before
+            else:
+                msg += '\n<<<\n%s\n>>>\n%s\n' % (before,after)
+            message.stderr(msg)
+    def write(self, event, fname):
+        """Append event to the JSON lines trace file fname."""
+        import json
+        if fname != self.fname:
+            if self.f is not None:
+                self.f.close()
+            self.f = open(fname, 'a')
+            self.fname = fname
+        self.f.write(json.dumps(event, sort_keys=True, encoding='latin-1'))
+        self.f.write('\n')
+        self.f.flush()
 
 class Message:
     """
@@ -192,8 +261,8 @@ class Message:
             msg = self.format(msg,linenos=linenos)
             self.stderr(msg)
 
-    def warning(self, msg,linenos=True,offset=0):
-        msg = self.format(msg,'WARNING: ',linenos,offset=offset)
+    def warning(self, msg,linenos=True,offset=0,cursor=None):
+        msg = self.format(msg,'WARNING: ',linenos,cursor=cursor,offset=offset)
         document.has_warnings = True
         self.stderr(msg)
 
@@ -203,7 +272,7 @@ class Message:
 
     def format(self, msg, prefix='', linenos=True, cursor=None, offset=0):
         """Return formatted message string."""
-        if self.linenos is not False and ((linenos or self.linenos) and reader.cursor):
+        if self.linenos is not False and ((linenos or self.linenos) and (reader.cursor or cursor)):
             if cursor is None:
                 cursor = reader.cursor
             prefix += '%s: line %d: ' % (os.path.basename(cursor[0]),cursor[1]+offset)
@@ -354,6 +423,40 @@ def is_array(obj):
     """
     return isinstance(obj,list) or isinstance(obj,tuple)
 
+def next_item(iterator):
+    """
+    Return the next item from iterator or None if it is exhausted (the
+    next() builtin requires Python 2.6).
+    """
+    try:
+        return iterator.next()
+    except StopIteration:
+        return None
+
+def json_encode(obj):
+    """
+    Return JSON string of obj, byte strings are encoded as Latin-1 JSON
+    strings (a lossless byte mapping).
+    """
+    import json
+    return json.dumps(obj, encoding='latin-1')
+
+def json_decode(s):
+    """
+    Decode JSON string s written by json_encode(), strings are returned as
+    bytes.
+    """
+    import json
+    def latin1(v):
+        if isinstance(v, unicode):
+            return v.encode('latin-1')
+        if isinstance(v, list):
+            return [latin1(x) for x in v]
+        if isinstance(v, dict):
+            return dict([(latin1(k),latin1(x)) for k,x in v.items()])
+        return v
+    return latin1(json.loads(s))
+
 def dovetail(lines1, lines2):
     """
     Append list or tuple of strings 'lines2' to list 'lines1'.  Join the last
@@ -473,34 +576,122 @@ else:   # Use deprecated CPython compiler module.
         values = compiler.parse("[" + val + "]", mode='eval').node.asList()
         return [literal_eval(v) for v in values]
 
-def parse_attributes(attrs,dict):
-    """Update a dictionary with name/value attributes from the attrs string.
-    The attrs string is a comma separated list of values and keyword name=value
-    pairs. Values must preceed keywords and are named '1','2'... The entire
-    attributes list is named '0'. If keywords are specified string values must
-    be quoted. Examples:
-
-    attrs: ''
-    dict: {}
-
-    attrs: 'hello,world'
-    dict: {'2': 'world', '0': 'hello,world', '1': 'hello'}
+# Parsed attribute lists keyed by attribute list string.
+attrlists = LRUCache()
+attrlist_word_re = re.compile(r'\w+(\.\w+)?')
 
-    attrs: '"hello", planet="earth"'
-    dict: {'planet': 'earth', '0': '"hello",planet="earth"', '1': 'hello'}
+def parse_attrlist(s):
     """
-    def f(*args,**keywords):
-        # Name and add aguments '1','2'... to keywords.
-        for i in range(len(args)):
-            if not str(i+1) in keywords:
-                keywords[str(i+1)] = args[i]
-        return keywords
+    Single pass parse of attribute list string 's' (with line separators
+    replaced by spaces) for the common case: quoted strings without
+    backslashes, integers, decimal numbers, None, True, False, unquoted
+    words and name=value keywords. Returns the attributes dictionary that
+    eval_attrlist() would, or None if 's' is outside this grammar.
+    """
+    if not s.strip() or '\\' in s or '\0' in s:
+        return None
+    # Split into comma separated items of tokens.
+    items = [[]]
+    i = 0
+    n = len(s)
+    while i < n:
+        c = s[i]
+        if c == ' ':
+            i += 1
+        elif c == ',':
+            items.append([])
+            i += 1
+        elif c == '"' or c == "'":
+            if s[i:i+3] == c*3:
+                return None
+            j = s.find(c, i+1)
+            if j < 0:
+                items = None    # Unterminated string.
+                break
+            items[-1].append(('s', s[i+1:j]))
+            i = j + 1
+        elif c == '=':
+            if s[i+1:i+2] == '=':
+                return None
+            items[-1].append(('=', c))
+            i += 1
+        else:
+            mo = attrlist_word_re.match(s, i)
+            if not mo:
+                return None
+            items[-1].append(('w', mo.group()))
+            i = mo.end()
+    # Evaluate items as Python call arguments; d is set to None if they are
+    # syntactically or semantically illegal Python literals.
+    if items is None:
+        d = None
+    else:
+        d = {}
+        keywords = False
+        for i,item in enumerate(items):
+            if not item:
+                if i == 0 or i < len(items) - 1:
+                    d = None    # Empty argument.
+                    break
+                continue
+            if len(item) == 1:
+                name = None
+                token = item[0]
+                if keywords:
+                    d = None    # Non-keyword argument after keyword.
+                    break
+            elif len(item) == 3 and item[0][0] == 'w' and item[1][0] == '=':
+                name = item[0][1]
+                token = item[2]
+                if not re.match(r'^[A-Za-z_]\w*$', name) or name == 'None':
+                    return None
+                if iskeyword(name) or name in d:
+                    d = None
+                    break
+                keywords = True
+            elif [t for t in item if t[0] == 'w'] == item and \
+                    not [t for t in item if iskeyword(t[1])]:
+                d = None    # Space separated words.
+                break
+            else:
+                return None
+            if token[0] == 's':
+                value = token[1]
+            elif token[0] == 'w':
+                word = token[1]
+                if re.match(r'^(0|[1-9]\d*)$', word):
+                    value = int(word)
+                    if value > sys.maxint:
+                        return None
+                elif re.match(r'^\d+\.\d+$', word):
+                    value = float(word)
+                elif word in ('None','True','False'):
+                    value = {'None':None, 'True':True, 'False':False}[word]
+                elif re.match(r'^[A-Za-z_]\w*$', word):
+                    d = None    # Not a literal.
+                    break
+                else:
+                    return None
+            else:
+                return None
+            d[name or str(i+1)] = value
+    if d is None:
+        # Not Python literals so all values are quoted strings.
+        d = {}
+        for i,v in enumerate(s.split(',')):
+            v = v.strip()
+            if v:
+                d[str(i+1)] = v
+        if not d:
+            return None
+    return d
 
-    if not attrs:
-        return
-    dict['0'] = attrs
-    # Replace line separators with spaces so line spanning works.
-    s = re.sub(r'\s', ' ', attrs)
+def eval_attrlist(s):
+    """
+    Parse attribute list string 's' (with line separators replaced by
+    spaces) using the Python parser. Returns the attributes dictionary, {}
+    if there's a syntax error.
+    """
     d = {}
     try:
         d.update(get_args(s))
@@ -518,11 +709,40 @@ def parse_attributes(attrs,dict):
             d.update(get_args(s))
             d.update(get_kwargs(s))
         except Exception:
-            return  # If there's a syntax error leave with {0}=attrs.
+            return {}  # If there's a syntax error leave with {0}=attrs.
         for k in d.keys():  # Drop any empty positional arguments.
             if d[k] == '': del d[k]
-    dict.update(d)
     assert len(d) > 0
+    return d
+
+def parse_attributes(attrs,dict):
+    """Update a dictionary with name/value attributes from the attrs string.
+    The attrs string is a comma separated list of values and keyword name=value
+    pairs. Values must preceed keywords and are named '1','2'... The entire
+    attributes list is named '0'. If keywords are specified string values must
+    be quoted. Examples:
+
+    attrs: ''
+    dict: {}
+
+    attrs: 'hello,world'
+    dict: {'2': 'world', '0': 'hello,world', '1': 'hello'}
+
+    attrs: '"hello", planet="earth"'
+    dict: {'planet': 'earth', '0': '"hello",planet="earth"', '1': 'hello'}
+    """
+    if not attrs:
+        return
+    dict['0'] = attrs
+    d = attrlists.get(attrs)
+    if d is None:
+        # Replace line separators with spaces so line spanning works.
+        s = re.sub(r'\s', ' ', attrs)
+        d = parse_attrlist(s)
+        if d is None:
+            d = eval_attrlist(s)
+        attrlists.put(attrs, d)
+    dict.update(d)
 
 def parse_named_attributes(s,attrs):
     """Update a attrs dictionary with name="value" attributes from the s string.
@@ -745,6 +965,84 @@ def is_attr_defined(attrs,dic):
     else:
         return dic.get(attrs.strip()) is not None
 
+# In-process filter modules keyed by file name, each value is a
+# (mtime,module) tuple, module is None if the filter must be run as a command.
+filter_modules = {}
+
+def filter_module(fname):
+    """
+    Return the Python filter script 'fname' loaded as a module if it can be
+    run in-process i.e. it defines an asciidoc_filter(lines,args) function
+    that returns the filtered lines. Return None if it can't.
+    """
+    mtime = os.path.getmtime(fname)
+    if fname in filter_modules and filter_modules[fname][0] == mtime:
+        return filter_modules[fname][1]
+    module = None
+    f = open(fname)
+    try:
+        source = f.read()
+    finally:
+        f.close()
+    if re.search(r'(?m)^def asciidoc_filter\(', source):
+        import imp
+        module = imp.new_module('asciidoc_filter_%d' % len(filter_modules))
+        module.__file__ = fname
+        try:
+            exec compile(source, fname, 'exec') in module.__dict__
+        except Exception:
+            message.warning('filter not loaded: %s: %s' %
+                    (fname, sys.exc_info()[1]))
+            module = None
+        if not hasattr(module, 'asciidoc_filter'):
+            module = None
+    filter_modules[fname] = (mtime,module)
+    return module
+
+def filter_args(s):
+    """
+    Return the argument list the shell would pass to a filter with command
+    line arguments 's' or None if 's' contains shell constructs (globs,
+    tildes, variables, escapes, redirection...) that shlex does not parse
+    the same way as /bin/sh.
+    """
+    if re.search(r'[^\w\s@%+=:,./\'"-]', s):
+        return None
+    try:
+        return shlex.split(s)
+    except ValueError:
+        return None
+
+def run_filter_module(module, lines, args, filter_cmd):
+    """
+    Run in-process filter 'module' on 'lines' and return the output lines
+    processed like the output of a filter command. Lines written to stdout
+    by the filter are output ahead of the returned lines. Return None if the
+    filter raised an exception (treated like a filter command's non-zero
+    exit code), a sys.exit() call is an error.
+    """
+    import StringIO
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        try:
+            result = module.asciidoc_filter(lines, args)
+        except SystemExit:
+            raise EAsciiDoc,'filter exited: %s: %s' % \
+                    (filter_cmd, sys.exc_info()[1])
+        except Exception:
+            message.warning('filter error: %s: %s' %
+                    (filter_cmd, sys.exc_info()[1]))
+            return None
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    if output:
+        if result and output.endswith(os.linesep):
+            output = output[:-len(os.linesep)]
+        result = output.split(os.linesep) + list(result)
+    return [s.rstrip() for s in result]
+
 def filter_lines(filter_cmd, lines, attrs={}):
     """
     Run 'lines' through the 'filter_cmd' shell command and return the result.
@@ -771,6 +1069,9 @@ def filter_lines(filter_cmd, lines, attrs={}):
         message.error('undefined filter attribute in command: %s' % filter_cmd)
         return []
     filter_cmd = s.strip()
+    if config.checking:
+        message.verbose('not filtering: ' + filter_cmd)
+        return lines
     # Parse for quoted and unquoted command and command tail.
     # Double quoted.
     mo = re.match(r'^"(?P<cmd>[^"]+)"(?P<tail>.*)$', filter_cmd)
@@ -803,6 +1104,27 @@ def filter_lines(filter_cmd, lines, attrs={}):
             message.warning('filter not found: %s' % cmd)
     if found:
         filter_cmd = '"' + found + '"' + mo.group('tail')
+        manifest.add_file(found)
+    manifest.add_command(filter_cmd)
+    key = (filter_cmd, tuple(lines))
+    if key in filter_outputs:
+        message.verbose('reusing filter output: ' + filter_cmd)
+        return list(filter_outputs[key])
+    if found and cmd.endswith('.py'):
+        # Run Python filters that support it in-process unless the shell
+        # would parse the arguments differently.
+        args = filter_args(mo.group('tail'))
+        module = args is not None and filter_module(found)
+        if module:
+            message.verbose('filtering in-process: ' + filter_cmd)
+            result = run_filter_module(module, lines, args, filter_cmd)
+            if result is None:
+                return []
+            if lines and not result:
+                message.warning('no output from filter: %s' % filter_cmd)
+            elif multibackend.backends:
+                filter_outputs[key] = result
+            return result
     if found:
         if cmd.endswith('.py'):
             filter_cmd = '"%s" %s' % (document.attributes['python'],
@@ -832,8 +1154,154 @@ def filter_lines(filter_cmd, lines, attrs={}):
                (filter_cmd, filter_status))
     if lines and not result:
         message.warning('no output from filter: %s' % filter_cmd)
+    elif multibackend.backends and not filter_status:
+        filter_outputs[key] = result
+    return result
+
+# Filter output lines keyed by (command,input lines) tuples. Outputs are
+# shared by the backends of a multiple backend conversion (see MultiBackend).
+filter_outputs = {}
+
+# Encoded data URIs keyed by file name, each value is a (mtime,uri) tuple.
+data_uris = {}
+
+def data_uri(fname):
+    """
+    Return the data URI of file 'fname'. The MIME type is guessed from the
+    file name. Encoded files are cached for the rest of the run, the cache
+    entry is dropped if the file's modification time changes.
+    """
+    fname = os.path.realpath(fname)
+    mtime = os.path.getmtime(fname)
+    if fname in data_uris and data_uris[fname][0] == mtime:
+        return data_uris[fname][1]
+    mimetype = mimetypes.guess_type(fname)[0] or 'application/octet-stream'
+    f = open(fname,'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    result = 'data:%s;base64,%s' % (mimetype, base64.b64encode(data))
+    data_uris[fname] = (mtime,result)
     return result
 
+# {sys:} command output lines keyed by (name,directory,command). sys_outputs
+# is cleared at the start of each document ('run' sys-cache policy).
+# sys_batch_outputs lasts the life of the process ('batch' policy) and
+# survives module reloads by asciidocapi.py.
+sys_outputs = {}
+try:
+    sys_batch_outputs
+except NameError:
+    sys_batch_outputs = {}
+
+def sys_output(name, cmd, syntax):
+    """
+    Execute shell command 'cmd' for the 'name' system attribute and return
+    the list of output lines. If the 'sys-cache' attribute is set outputs
+    are cached for the document ('run'), for all documents processed by
+    the process ('batch') or in the 'sys-cache-dir' directory for
+    'sys-cache-ttl' seconds ('persistent'). Commands matching the
+    'sys-cache-exclude' regular expression are not cached.
+    """
+    policy = document.attributes.get('sys-cache')
+    if policy not in (None, 'run', 'batch', 'persistent'):
+        message.warning('illegal sys-cache policy: %s' % policy)
+        policy = None
+    exclude = document.attributes.get('sys-cache-exclude')
+    if policy and exclude:
+        try:
+            if re.search(exclude, cmd):
+                policy = None
+        except re.error:
+            message.warning('illegal sys-cache-exclude: %s' % exclude)
+    key = (name, os.getcwd(), cmd)
+    manifest.add_command(cmd)
+    manifest.volatile = True
+    cachefile = None
+    if policy == 'run' and key in sys_outputs:
+        return sys_outputs[key]
+    if policy == 'batch' and key in sys_batch_outputs:
+        return sys_batch_outputs[key]
+    if policy == 'persistent':
+        cachedir = document.attributes.get('sys-cache-dir')
+        if not cachedir and USER_DIR:
+            cachedir = os.path.join(USER_DIR, 'cache')
+        ttl = document.attributes.get('sys-cache-ttl', '3600')
+        if not re.match(r'^\d+$', ttl):
+            message.warning('illegal sys-cache-ttl: %s' % ttl)
+            ttl = '0'
+        if cachedir:
+            try:
+                from hashlib import md5
+            except ImportError:
+                from md5 import md5
+            cachefile = os.path.join(cachedir,
+                    'sys-' + md5(repr(key)).hexdigest())
+            if os.path.isfile(cachefile) and \
+                    time.time() - os.path.getmtime(cachefile) < int(ttl):
+                message.verbose('cached: %s' % cmd)
+                f = open(cachefile)
+                try:
+                    return [s.rstrip() for s in f]
+                finally:
+                    f.close()
+        else:
+            message.warning('sys-cache-dir undefined: %s' % syntax)
+    message.verbose('shelling: %s' % cmd)
+    if name == 'sys2':
+        stderr = subprocess.STDOUT
+    else:
+        stderr = None
+    try:
+        p = subprocess.Popen(cmd, shell=True,
+                stdout=subprocess.PIPE, stderr=stderr)
+        output = p.communicate()[0]
+    except Exception:
+        raise EAsciiDoc,'%s: shell error: %s' % (syntax, sys.exc_info()[1])
+    lines = [s.rstrip() for s in output.split('\n')]
+    if lines and not lines[-1]:
+        del lines[-1]
+    if p.returncode:
+        # Failed commands are not cached.
+        message.warning('%s: non-zero exit status' % syntax)
+    elif policy == 'run':
+        sys_outputs[key] = lines
+    elif policy == 'batch':
+        sys_batch_outputs[key] = lines
+    elif cachefile:
+        try:
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+            fd,tmp = tempfile.mkstemp(dir=cachedir)
+            f = os.fdopen(fd, 'w')
+            try:
+                f.write(''.join([s + '\n' for s in lines]))
+            finally:
+                f.close()
+            if os.name == 'nt' and os.path.isfile(cachefile):
+                os.remove(cachefile)
+            os.rename(tmp, cachefile)
+        except (IOError, OSError):
+            message.warning('%s: cache write error: %s' %
+                    (syntax, sys.exc_info()[1]))
+    return lines
+
+# Compiled Python expressions keyed by expression text.
+expressions = LRUCache()
+
+def compile_expression(expr):
+    """
+    Return the code object for Python expression string 'expr', code
+    objects are cached so repeated evaluations are not recompiled.
+    Leading spaces and tabs are stripped, as eval() does with strings.
+    """
+    code = expressions.get(expr)
+    if code is None:
+        code = compile(expr.lstrip(' \t'), '<string>', 'eval')
+        expressions.put(expr, code)
+    return code
+
 def system(name, args, is_macro=False, attrs=None):
     """
     Evaluate a system attribute ({name:args}) or system block macro
@@ -850,7 +1318,7 @@ def system(name, args, is_macro=False, attrs=None):
     else:
         syntax = '{%s:%s}' % (name,args)
         separator = writer.newline
-    if name not in ('eval','eval3','sys','sys2','sys3','include','include1','counter','counter2','set','set2','template'):
+    if name not in ('eval','eval3','sys','sys2','sys3','include','include1','counter','counter2','set','set2','template','datauri'):
         if is_macro:
             msg = 'illegal system macro name: %s' % name
         else:
@@ -865,13 +1333,13 @@ def system(name, args, is_macro=False, attrs=None):
         args = s
     if name != 'include1':
         message.verbose('evaluating: %s' % syntax)
-    if safe() and name not in ('include','include1'):
+    if safe() and name not in ('include','include1','datauri'):
         message.unsafe(syntax)
         return None
     result = None
     if name in ('eval','eval3'):
         try:
-            result = eval(args)
+            result = eval(compile_expression(args))
             if result is True:
                 result = ''
             elif result is False:
@@ -881,37 +1349,17 @@ def system(name, args, is_macro=False, attrs=None):
         except Exception:
             message.warning('%s: evaluation error' % syntax)
     elif name in ('sys','sys2','sys3'):
-        result = ''
-        fd,tmp = tempfile.mkstemp()
-        os.close(fd)
-        try:
-            cmd = args
-            cmd = cmd + (' > "%s"' % tmp)
-            if name == 'sys2':
-                cmd = cmd + ' 2>&1'
-            if os.name == 'nt':
-                # Remove redundant quoting -- this is not just
-                # cosmetic, unnecessary quoting appears to cause
-                # command line truncation.
-                cmd = re.sub(r'"([^ ]+?)"', r'\1', cmd)
-            message.verbose('shelling: %s' % cmd)
-            if os.system(cmd):
-                message.warning('%s: non-zero exit status' % syntax)
-            try:
-                if os.path.isfile(tmp):
-                    f = open(tmp)
-                    try:
-                        lines = [s.rstrip() for s in f]
-                    finally:
-                        f.close()
-                else:
-                    lines = []
-            except Exception:
-                raise EAsciiDoc,'%s: temp file read error' % syntax
-            result = separator.join(lines)
-        finally:
-            if os.path.isfile(tmp):
-                os.remove(tmp)
+        cmd = args
+        if os.name == 'nt':
+            # Remove redundant quoting -- this is not just
+            # cosmetic, unnecessary quoting appears to cause
+            # command line truncation.
+            cmd = re.sub(r'"([^ ]+?)"', r'\1', cmd)
+        if config.checking:
+            message.verbose('not shelling: %s' % cmd)
+            result = ''
+        else:
+            result = separator.join(sys_output(name, cmd, syntax))
     elif name in ('counter','counter2'):
         mo = re.match(r'^(?P<attr>[^:]*?)(:(?P<seed>.*))?$', args)
         attr = mo.group('attr')
@@ -928,14 +1376,13 @@ def system(name, args, is_macro=False, attrs=None):
                 message.warning('%s: illegal counter value: %s'
                                 % (syntax,value))
                 return None
-            if re.match(r'^\d+$', value):
-                expr = value + '+1'
-            else:
-                expr = 'chr(ord("%s")+1)' % value
             try:
-                result = str(eval(expr))
+                if re.match(r'^\d+$', value):
+                    result = str(int(value) + 1)
+                else:
+                    result = chr(ord(value) + 1)
             except Exception:
-                message.warning('%s: evaluation error: %s' % (syntax, expr))
+                message.warning('%s: evaluation error: %s' % (syntax, value))
         else:
             if seed:
                 result = seed
@@ -962,11 +1409,14 @@ def system(name, args, is_macro=False, attrs=None):
                 attrs[attr] = value
             if name != 'set2':  # set2 only updates local attributes.
                 document.attributes[attr] = value
+                if attr == 'trace':
+                    trace.update()
         if value is None:
             result = None
         else:
             result = ''
     elif name == 'include':
+        manifest.add_file(args)
         if not os.path.exists(args):
             message.warning('%s: file does not exist' % syntax)
         elif not is_safe_file(args):
@@ -985,6 +1435,22 @@ def system(name, args, is_macro=False, attrs=None):
                 result = ''
     elif name == 'include1':
         result = separator.join(config.include1[args])
+    elif name == 'datauri':
+        result = ''
+        fname = args
+        if not os.path.isabs(fname):
+            # Relative file names are relative to the document directory.
+            d = document.attributes.get('indir')
+            if d is None:
+                d = document.attributes.get('outdir','')
+            fname = os.path.join(d, fname)
+        manifest.add_file(fname)
+        if not os.path.isfile(fname):
+            message.warning('%s: file does not exist' % syntax)
+        elif not is_safe_file(fname):
+            message.unsafe(syntax)
+        elif not config.checking:
+            result = data_uri(fname)
     elif name == 'template':
         if not args in config.sections:
             message.warning('%s: template does not exist' % syntax)
@@ -1178,7 +1644,8 @@ def subs_attrs(lines, dictionary=None):
         # Drop line if it contains  unsubstituted {name} references.
         skipped = re.search(r'(?su)\{[^\\\W][-\w]*?\}(?!\\)', line)
         if skipped:
-            trace('dropped line', line)
+            if trace.active:
+                trace('dropped line', line)
             continue;
         # Expand system attributes (eval has precedence).
         reos = [
@@ -1293,6 +1760,9 @@ class Lex:
     """Lexical analysis routines. Static methods and attributes only."""
     prev_element = None
     prev_cursor = None
+    # Substitutions performed by --check (they can report errors, define IDs
+    # and cross-references).
+    CHECK_SUBS = ('specialcharacters','attributes','macros','callouts')
     def __init__(self):
         raise AssertionError,'no class instances allowed'
     @staticmethod
@@ -1307,6 +1777,19 @@ class Lex:
         # position return the element.
         if Lex.prev_element and Lex.prev_cursor == reader.cursor:
             return Lex.prev_element
+        result = parsecache.lookup()
+        if result is None:
+            result = Lex.scan()
+            parsecache.record(result)
+        # Optimization: Cache answer.
+        Lex.prev_cursor = reader.cursor
+        Lex.prev_element = result
+        return result
+
+    @staticmethod
+    def scan():
+        """Match the next input lines against each element type and return
+        the matched element class (c.f. next())."""
         if AttributeEntry.isnext():
             result = AttributeEntry
         elif AttributeList.isnext():
@@ -1332,9 +1815,6 @@ class Lex:
             if not paragraphs.isnext():
                 raise EAsciiDoc,'paragraph expected'
             result = paragraphs.current
-        # Optimization: Cache answer.
-        Lex.prev_cursor = reader.cursor
-        Lex.prev_element = result
         return result
 
     @staticmethod
@@ -1349,6 +1829,16 @@ class Lex:
                 options = config.subsverbatim
         return options
 
+    @staticmethod
+    def content_subs(options):
+        """Return block content substitutions 'options', --check only
+        performs CHECK_SUBS. Titles are not reduced because section IDs are
+        generated from substituted titles."""
+        if config.checking and options:
+            options = Lex.canonical_subs(options)
+            options = tuple([o for o in options if o in Lex.CHECK_SUBS])
+        return options
+
     @staticmethod
     def subs_1(s,options):
         """Perform substitution specified in 'options' (in 'options' order)."""
@@ -1375,7 +1865,8 @@ class Lex:
                 result = macros.subs(result,callouts=True)
             else:
                 raise EAsciiDoc,'illegal substitution option: %s' % o
-            trace(o, s, result)
+            if trace.active:
+                trace(o, s, result)
             if not result:
                 break
         return result
@@ -1508,6 +1999,7 @@ class Document(object):
             if ext:
                 self.attributes['filetype'] = ext
                 self.attributes['filetype-'+ext] = ''
+        trace.update()
     def load_lang(self):
         """
         Load language configuration file.
@@ -1663,12 +2155,16 @@ class Document(object):
         while not reader.eof():
             if Lex.next() is not Title:
                 raise EAsciiDoc,'section title expected'
+            if parallel.jobs > 1 and Title.level <= 1:
+                parallel.split()
             Section.translate()
         Section.setlevel(0) # Write remaining unwritten section close tags.
         # Substitute document parameters and write document footer.
         if config.header_footer:
             ftr = config.subs_section('footer',{})
             writer.write(ftr,trace='footer')
+        if parallel.jobs > 1:
+            parallel.split(final=True)
     def parse_author(self,s):
         """ Return False if the author is malformed."""
         attrs = self.attributes # Alias for readability.
@@ -1908,6 +2404,8 @@ class AttributeEntry:
             elif attr.name in document.attributes:
                 del document.attributes[attr.name]
             attr.attributes[attr.name] = attr.value
+            if attr.name == 'trace':
+                trace.update()
 
 class AttributeList:
     """Static methods and attributes only."""
@@ -1947,6 +2445,10 @@ class AttributeList:
                     AttributeList.attrs[k] = v
         AttributeList.subs(attrs)
         AttributeList.attrs.update(attrs)
+        id = attrs.get('id') or d.get('id')
+        if id:
+            anchors.add(id, 'block',
+                    attrs.get('reftext') or AttributeList.attrs.get('reftext'))
     @staticmethod
     def subs(attrs):
         '''Substitute single quoted attribute values normally.'''
@@ -2213,10 +2715,275 @@ class FloatingTitle(Title):
             message.warning('missing template section: [%s]' % template)
 
 
+class Anchors:
+    """
+    Document-wide registry of element IDs: generated section IDs, block IDs
+    (from attribute lists) and inline anchors along with their source
+    locations. There is a single global instance of this class named
+    anchors.
+    """
+    def __init__(self):
+        self.ids = {}       # Index entries keyed by id.
+        self.index = []     # Index entries in document order.
+        self.suffixes = {}  # Next unique() numeric suffix keyed by base id.
+        self.xrefs = []     # (id,file,line) of cross-references.
+    def add(self, id, type, reftext=None):
+        """
+        Register id at the current reader location. Duplicate ids are
+        reported, the same id at the same location is registered once.
+        Returns the index entry.
+        """
+        cursor = reader.cursor or ['<stdin>',0,'']
+        entry = self.ids.get(id)
+        if entry is not None:
+            if (entry['file'],entry['line']) != (cursor[0],cursor[1]):
+                message.warning('duplicate id: %s (first defined in %s: line %d)'
+                        % (id, os.path.basename(entry['file']), entry['line']))
+            return entry
+        entry = {'id': id, 'type': type, 'file': cursor[0],
+                 'line': cursor[1], 'reftext': reftext}
+        self.ids[id] = entry
+        self.index.append(entry)
+        return entry
+    def unique(self, base_id):
+        """Return the first unused id from base_id, base_id_2, base_id_3..."""
+        i = self.suffixes.get(base_id, 1)
+        while True:
+            if i == 1:
+                id = base_id
+            else:
+                id = '%s_%d' % (base_id, i)
+            if id not in self.ids:
+                break
+            i += 1
+        self.suffixes[base_id] = i + 1
+        return id
+    def add_macro(self, name, d):
+        """Register the id of an inline anchor macro (c.f. Macro.subs())."""
+        if name == 'anchor':
+            id,reftext = d.get('target'),d.get('1')
+        elif name == 'anchor2':
+            id,reftext = d.get('1'),d.get('2')
+        else:
+            id,reftext = d.get('1'),None
+        if id:
+            self.add(id, 'inline', reftext)
+    def add_xref(self, name, d):
+        """Record the target of an xref or xref2 macro (c.f. Macro.subs())."""
+        if name == 'xref':
+            id = d.get('target')
+        else:
+            id = d.get('1')
+        if id:
+            cursor = reader.cursor or ['<stdin>',0,'']
+            self.xrefs.append((id, cursor[0], cursor[1]))
+    def check_xrefs(self):
+        """
+        Report cross-references with targets that are not document IDs.
+        Returns the number of dangling cross-references.
+        """
+        count = 0
+        for id,fname,lineno in sorted(self.xrefs, key=lambda x: x[1:]):
+            if id not in self.ids:
+                message.warning('dangling cross-reference: %s' % id,
+                        cursor=(fname,lineno))
+                count += 1
+        return count
+    def write_index(self, fname):
+        """Write the anchor index to JSON file fname."""
+        import json
+        message.verbose('writing: %s' % fname, False)
+        f = open(fname, 'w')
+        try:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+            f.write('\n')
+        finally:
+            f.close()
+
+class ParseCache:
+    """
+    Optional cache of the element definition each element's leading source
+    lines parsed to. The cache is enabled by the 'parse-cache' attribute and
+    is written to a compressed cache file. The next conversion (e.g. to
+    another backend or after a template change) reads the cache and
+    Lex.next() checks the cached element definition instead of matching the
+    input against every element definition. There is a single global
+    instance of this class named parsecache.
+    """
+    VERSION = 2     # Cache file format.
+    def __init__(self):
+        self.active = False     # True if the cache is being used.
+        self.elements = {}      # Cached element keys keyed by leading lines.
+        self.parsed = {}        # Element keys parsed by this conversion.
+        self.definitions = {}   # (container,element) keyed by element key.
+        self.signatures = {}    # Definition patterns keyed by element key.
+        self.added = []         # (container,element) not in the cache.
+        self.lines = None       # Leading lines of the next element.
+        self.key = None         # Element type patterns digest.
+        self.cache = None       # Cached elements (c.f. dump()).
+    @staticmethod
+    def cache_file(infile):
+        """Return the cache file name from the 'parse-cache' attribute."""
+        fname = document.attributes.get('parse-cache')
+        if not fname:
+            if infile == '<stdin>':
+                raise EAsciiDoc,'parse-cache file name required'
+            fname = os.path.splitext(infile)[0] + '.parse'
+        return fname
+    @staticmethod
+    def patterns_key():
+        """Return digest of the element type patterns that are not block
+        or block macro definitions."""
+        try:
+            from hashlib import sha1
+        except ImportError:
+            from sha import sha as sha1
+        patterns = [document.attributes.get('attributeentry-pattern'),
+                AttributeList.pattern, BlockTitle.pattern, Title.pattern,
+                Title.underlines, sorted(Title.dump_dict.items()),
+                [(b.defname,b.delimiter) for b in tables_OLD.blocks]]
+        return sha1(repr(patterns)).hexdigest()
+    def load_definitions(self):
+        """Build the block and block macro definitions tables."""
+        self.definitions = {}
+        self.signatures = {}
+        for container in (paragraphs,lists,blocks,tables):
+            for b in container.blocks:
+                self.definitions[b.defname] = (container,b)
+                self.signatures[b.defname] = b.delimiter
+        for m in macros.macros:
+            if m.prefix == '#':
+                key = self.element_key(m)
+                self.definitions[key] = (macros,m)
+                self.signatures[key] = ''
+    def begin(self, infile):
+        """Start recording parsed elements and load the cached elements."""
+        self.active = True
+        self.load_definitions()
+        self.key = self.patterns_key()
+        self.added = self.definitions.values()
+        if self.cache is None and 'parse-cache' in document.attributes:
+            self.cache = self.read(self.cache_file(infile))
+        if self.cache is None:
+            return
+        cache = self.cache
+        if cache['version'] != self.VERSION or cache['key'] != self.key:
+            message.verbose('parse-cache patterns changed', False)
+            return
+        # Definitions that are new or have changed could match cached lines,
+        # cached elements of changed definitions are discarded.
+        signatures = cache['definitions']
+        self.added = [self.definitions[k] for k,v in self.signatures.items()
+                      if signatures.get(k) != v]
+        for lines,key in cache['elements']:
+            if key in self.definitions:
+                if signatures.get(key) != self.signatures[key]:
+                    continue
+            self.elements[tuple(lines)] = key
+    def read(self, fname):
+        """Return the cache read from file fname, None if there is no valid
+        cache file."""
+        if not os.path.isfile(fname):
+            return None
+        import zlib
+        try:
+            f = open(fname, 'rb')
+            try:
+                cache = json_decode(zlib.decompress(f.read()))
+            finally:
+                f.close()
+            for k in ('version','key','definitions','elements'):
+                if k not in cache:
+                    raise KeyError,k
+        except (IOError,ValueError,KeyError,TypeError,zlib.error):
+            message.warning('illegal parse-cache file: %s' % fname, False)
+            return None
+        message.verbose('reading: %s' % fname, False)
+        return cache
+    def dump(self):
+        """Return the cache of parsed elements."""
+        return {'version': self.VERSION, 'key': self.key,
+                'definitions': self.signatures,
+                'elements': [[list(k),v] for k,v in self.parsed.items()]}
+    def end(self, infile):
+        """Write the parsed elements to the cache file."""
+        import zlib
+        fname = self.cache_file(infile)
+        message.verbose('writing: %s' % fname, False)
+        f = open(fname, 'wb')
+        try:
+            f.write(zlib.compress(json_encode(self.dump())))
+        finally:
+            f.close()
+    @staticmethod
+    def element_key(element):
+        """Return the cache key of element class or instance, None if the
+        element is not cached."""
+        if element in (AttributeEntry,AttributeList,BlockTitle):
+            return element.__name__
+        elif element in (Title,FloatingTitle):
+            return 'Title'
+        elif isinstance(element,Macro):
+            return 'macro:' + element.pattern
+        elif isinstance(element,AbstractBlock) and \
+                not isinstance(element,Table_OLD):
+            return element.defname
+        else:
+            return None
+    @staticmethod
+    def matches(container, element, line):
+        """Return True if block or block macro definition element matches
+        the next input line."""
+        if container is macros:
+            return element.reo.match(line) is not None
+        else:
+            return element.isnext()
+    def lookup(self):
+        """Return the cached element for the next input lines (c.f.
+        Lex.next()), None if not cached."""
+        if not self.active:
+            return None
+        self.lines = reader.read_ahead(2)
+        key = self.elements.get(self.lines)
+        if key is None:
+            return None
+        for container,element in self.added:
+            if self.matches(container, element, self.lines[0]):
+                return None
+        result = None
+        if key == 'Title':
+            if Title.isnext():
+                if AttributeList.style() == 'float':
+                    result = FloatingTitle
+                else:
+                    result = Title
+        elif key in ('AttributeEntry','AttributeList','BlockTitle'):
+            element = globals()[key]
+            if element.isnext():
+                result = element
+        elif key in self.definitions:
+            container,element = self.definitions[key]
+            if self.matches(container, element, self.lines[0]):
+                result = element
+                container.current = element
+        if result is not None:
+            self.parsed[self.lines] = key
+        return result
+    def record(self, element):
+        """Record the element type of the next input lines."""
+        if not self.active:
+            return
+        key = self.element_key(element)
+        # Lex.scan() sets the block title of other elements that match the
+        # block title pattern.
+        if key is None or element is not BlockTitle and \
+                re.match(BlockTitle.pattern, self.lines[0]):
+            return
+        self.parsed[self.lines] = key
+
 class Section:
     """Static methods and attributes only."""
     endtags = []  # Stack of currently open section (level,endtag) tuples.
-    ids = []      # List of already used ids.
     def __init__(self):
         raise AssertionError,'no class instances allowed'
     @staticmethod
@@ -2251,24 +3018,21 @@ class Section:
         # defined. Prefix ensures the ID does not clash with existing IDs.
         idprefix = document.attributes.get('idprefix','_')
         base_id = idprefix + base_id
-        i = 1
-        while True:
-            if i == 1:
-                id = base_id
-            else:
-                id = '%s_%d' % (base_id, i)
-            if id not in Section.ids:
-                Section.ids.append(id)
-                return id
-            else:
-                id = base_id
-            i += 1
+        return anchors.unique(base_id)
     @staticmethod
     def set_id():
-        if not document.attributes.get('sectids') is None \
-                and 'id' not in AttributeList.attrs:
+        id = AttributeList.attrs.get('id')
+        if id:
+            # Explicit section id (registered by AttributeList.translate()).
+            entry = anchors.ids.get(id)
+            if entry:
+                entry['type'] = 'section'
+                entry['reftext'] = entry['reftext'] or Title.attributes['title']
+        elif not document.attributes.get('sectids') is None:
             # Generate ids for sections.
-            AttributeList.attrs['id'] = Section.gen_id(Title.attributes['title'])
+            id = Section.gen_id(Title.attributes['title'])
+            anchors.add(id, 'section', Title.attributes['title'])
+            AttributeList.attrs['id'] = id
     @staticmethod
     def translate():
         assert Lex.next() is Title
@@ -2302,8 +3066,11 @@ class Section:
         AttributeList.consume(Title.attributes)
         stag,etag = config.section2tags(Title.sectname,Title.attributes)
         Section.savetag(Title.level,etag)
-        writer.write(stag,trace='section open: level %d: %s' %
-                (Title.level, Title.attributes['title']))
+        if trace.active:
+            writer.write(stag,trace='section open: level %d: %s' %
+                    (Title.level, Title.attributes['title']))
+        else:
+            writer.write(stag)
         Section.translate_body()
     @staticmethod
     def translate_body(terminator=Title):
@@ -2545,7 +3312,8 @@ class AbstractBlock:
         '''
         if blockname is None:
             blockname = self.attributes.get('style', self.short_name()).lower()
-        trace('push blockname', blockname)
+        if trace.active:
+            trace('push blockname', blockname)
         self.blocknames.append(blockname)
         document.attributes['blockname'] = blockname
     def pop_blockname(self):
@@ -2555,7 +3323,8 @@ class AbstractBlock:
         '''
         assert len(self.blocknames) > 0
         blockname = self.blocknames.pop()
-        trace('pop blockname', blockname)
+        if trace.active:
+            trace('pop blockname', blockname)
         if len(self.blocknames) == 0:
             document.attributes['blockname'] = None
         else:
@@ -2715,8 +3484,8 @@ class Paragraph(AbstractBlock):
         if 'skip' in self.parameters.options:
             return
         body = [self.text] + list(body)
-        presubs = self.parameters.presubs
-        postsubs = self.parameters.postsubs
+        presubs = Lex.content_subs(self.parameters.presubs)
+        postsubs = Lex.content_subs(self.parameters.postsubs)
         if document.attributes.get('plaintext') is None:
             body = Lex.set_margin(body) # Move body to left margin.
         body = Lex.subs(body,presubs)
@@ -2825,7 +3594,8 @@ class List(AbstractBlock):
         if self.text:
             text = [self.text] + list(text)
         if text:
-            writer.write_tag(self.tag.text, text, self.presubs, self.attributes,trace='list text')
+            writer.write_tag(self.tag.text, text, Lex.content_subs(self.presubs),
+                    self.attributes,trace='list text')
         # Process explicit and implicit list item continuations.
         while True:
             continuation = reader.read_next() == '+'
@@ -3066,26 +3836,36 @@ class DelimitedBlock(AbstractBlock):
         else:
             template = self.parameters.template
             template = subs_attrs(template,self.attributes)
-            name = self.short_name()+' block'
             if 'sectionbody' in options:
                 # The body is treated like a section body.
                 stag,etag = config.section2tags(template,self.attributes)
-                writer.write(stag,trace=name+' open')
+                if trace.active:
+                    writer.write(stag,trace=self.short_name()+' block open')
+                else:
+                    writer.write(stag)
                 Section.translate_body(self)
-                writer.write(etag,trace=name+' close')
+                if trace.active:
+                    writer.write(etag,trace=self.short_name()+' block close')
+                else:
+                    writer.write(etag)
             else:
                 stag = config.section2tags(template,self.attributes,skipend=True)[0]
                 body = reader.read_until(self.delimiter,same_file=True)
-                presubs = self.parameters.presubs
-                postsubs = self.parameters.postsubs
+                presubs = Lex.content_subs(self.parameters.presubs)
+                postsubs = Lex.content_subs(self.parameters.postsubs)
                 body = Lex.subs(body,presubs)
                 if self.parameters.filter:
                     body = filter_lines(self.parameters.filter,body,self.attributes)
                 body = Lex.subs(body,postsubs)
                 # Write start tag, content, end tag.
                 etag = config.section2tags(template,self.attributes,skipstart=True)[1]
-                writer.write(dovetail_tags(stag,body,etag),trace=name)
-            trace(self.short_name()+' block close',etag)
+                body = dovetail_tags(stag,body,etag)
+                if trace.active:
+                    writer.write(body,trace=self.short_name()+' block')
+                else:
+                    writer.write(body)
+            if trace.active:
+                trace(self.short_name()+' block close',etag)
         if reader.eof():
             self.error('missing closing delimiter',self.start)
         else:
@@ -3135,28 +3915,177 @@ class Cell:
         result.reserved = True
         return result
 
-class Table(AbstractBlock):
-    ALIGN = {'<':'left', '>':'right', '^':'center'}
-    VALIGN = {'<':'top', '>':'bottom', '^':'middle'}
-    FORMATS = ('psv','csv','dsv')
-    SEPARATORS = dict(
-        csv=',',
-        dsv=r':|\n',
-        # The count and align group matches are not exact.
-        psv=r'((?<!\S)((?P<span>[\d.]+)(?P<op>[*+]))?(?P<align>[<\^>.]{,3})?(?P<style>[a-z])?)?\|'
-    )
-    def __init__(self):
-        AbstractBlock.__init__(self)
-        self.CONF_ENTRIES += ('format','tags','separator')
-        # tabledef conf file parameters.
-        self.format='psv'
-        self.separator=None
-        self.tags=None          # Name of tabletags-<tags> conf section.
-        # Calculated parameters.
+class CellPlan:
+    """
+    Table cell rendering precomputed for a column, cell style and row type.
+    Start and end tags are substituted once for each distinct combination
+    of cell alignments and spans.
+    """
+    PLAIN_RE = re.compile(r'^[A-Za-z0-9 ]*\Z')
+    # Separates cells substituted in one batch (see Table.batch_subs()).
+    SENTINEL = '\x06'
+    # Punctuation allowed in batched cells: none of it can open an inline
+    # construct that spans lines.
+    BATCH_CHARS = ' .,!?%=@&-'
+    def __init__(self, table, ci, style, rowtype):
+        self.table = table
+        self.column = col = table.columns[ci]
+        if rowtype == 'header':
+            # Use table style unless overriden by cell style.
+            colstyle = style
+        else:
+            # If the cell style is not defined use the column style.
+            colstyle = style or col.style
+        tags = table.get_tags(colstyle)
+        self.presubs,self.postsubs = table.get_subs(colstyle)
+        self.presubs = Lex.content_subs(self.presubs)
+        self.postsubs = Lex.content_subs(self.postsubs)
+        self.filter = table.get_param('filter',colstyle)
+        if self.filter and not self.filter.strip():
+            self.filter = None
+        if rowtype != 'header':
+            self.ptag = tags.paragraph
+        else:
+            self.ptag = None
+        if rowtype == 'header':
+            self.dtag = tags.headdata
+        elif rowtype == 'footer':
+            self.dtag = tags.footdata
+        else:
+            self.dtag = tags.bodydata
+        self.attributes = {
+            'colabswidth': col.abswidth,
+            'colpcwidth': col.pcwidth,
+            'colnumber': str(ci+1),
+            'colstart': str(ci+1),
+        }
+        self.ci = ci
+        self.tags = {}  # Substituted tags keyed by cell alignments and spans.
+        self.plain_patterns = self.get_plain_patterns()
+        self.batch_re = self.get_batch_re()
+    def get_plain_patterns(self):
+        """
+        Return the list of compiled patterns that could substitute text
+        containing only letters, digits and spaces, or None if such text may
+        be changed by the substitutions in other ways.
+        """
+        subs = Lex.canonical_subs(self.presubs or ()) + \
+               Lex.canonical_subs(self.postsubs or ())
+        chars = ''
+        result = []
+        for o in subs:
+            if o == 'specialcharacters':
+                chars += ''.join(config.specialchars.keys())
+            elif o == 'quotes':
+                chars += ''.join(config.quotes.keys())
+            elif o == 'specialwords':
+                result += [re.compile(w) for w in config.specialwords.keys()]
+            elif o in ('replacements','replacements2','replacements3'):
+                result += [re.compile(p) for p in getattr(config,o).keys()]
+            elif o in ('macros','callouts'):
+                result += [m.reo for m in macros.macros if m.prefix == '']
+        if re.search(r'[A-Za-z0-9 ]', chars):
+            return None
+        return result
+    def get_batch_re(self):
+        """
+        Return the pattern matching cell data that can be substituted in a
+        batch with other cells or None if the plan cannot be batched.
+        """
+        if self.filter or not (self.presubs or self.postsubs) or \
+                config.specialwords:
+            return None
+        chars = self.BATCH_CHARS
+        for q in config.quotes.keys():
+            for c in q:
+                chars = chars.replace(c, '')
+        # Single line that starts and ends with a letter or digit (PSV cell
+        # data includes the spaces and line breaks before the separator).
+        return re.compile(
+            r'^[ \n]*[A-Za-z0-9]([A-Za-z0-9\x80-\xff%s]*[A-Za-z0-9])?[ \n]*\Z'
+                % re.escape(chars))
+    def is_batchable(self, data):
+        """Return True if data can be substituted in a batch of cells."""
+        return self.batch_re is not None and \
+                self.batch_re.match(data) is not None
+    def is_plain(self, data):
+        """Return True if inline substitutions would not change data."""
+        if self.plain_patterns is None or not self.PLAIN_RE.match(data):
+            return False
+        for reo in self.plain_patterns:
+            if reo.search(data):
+                return False
+        return True
+    def render(self, cell, data=None):
+        """
+        Return a list of marked up table cell element lines. data is the
+        already substituted cell data (if any).
+        """
+        table = self.table
+        halign = cell.halign or self.column.halign
+        valign = cell.valign or self.column.valign
+        key = (halign, valign, cell.span, cell.vspan)
+        tags = self.tags.get(key)
+        if tags is None or self.filter:
+            # Set the cell attributes used by the tags and the filter.
+            attrs = table.attributes
+            attrs.update(self.attributes)
+            attrs['halign'] = halign
+            attrs['valign'] = valign
+            attrs['colspan'] = str(cell.span)
+            attrs['colend'] = str(self.ci+cell.span)
+            attrs['rowspan'] = str(cell.vspan)
+            attrs['morerows'] = str(cell.vspan-1)
+        if tags is None:
+            if self.ptag:
+                tags = subs_tag(self.ptag,table.attributes)
+            else:
+                tags = [None,None]
+            tags = tuple(tags) + tuple(subs_tag(self.dtag,table.attributes))
+            self.tags[key] = tags
+        pstag,petag,dstag,detag = tags
+        if data is None:
+            data = [cell.data]
+            if self.filter or not self.is_plain(cell.data):
+                data = Lex.subs(data, self.presubs)
+                data = filter_lines(self.filter, data, table.attributes)
+                data = Lex.subs(data, self.postsubs)
+            elif not cell.data and (self.presubs or self.postsubs):
+                data = []   # Same as Lex.subs().
+        if self.ptag:
+            text = '\n'.join(data).strip()
+            data = []
+            for para in re.split(r'\n{2,}',text):
+                data += dovetail_tags([pstag],para.split('\n'),[petag])
+        return dovetail_tags([dstag],data,[detag])
+
+class Table(AbstractBlock):
+    ALIGN = {'<':'left', '>':'right', '^':'center'}
+    VALIGN = {'<':'top', '>':'bottom', '^':'middle'}
+    FORMATS = ('psv','csv','dsv')
+    SEPARATORS = dict(
+        csv=',',
+        dsv=r':|\n',
+        # The count and align group matches are not exact.
+        psv=r'((?<!\S)((?P<span>[\d.]+)(?P<op>[*+]))?(?P<align>[<\^>.]{,3})?(?P<style>[a-z])?)?\|'
+    )
+    # Source lines parsed and body rows rendered per chunk by streamed tables.
+    STREAM_LINES = 1000
+    STREAM_ROWS = 100
+    def __init__(self):
+        AbstractBlock.__init__(self)
+        self.CONF_ENTRIES += ('format','tags','separator')
+        # tabledef conf file parameters.
+        self.format='psv'
+        self.separator=None
+        self.tags=None          # Name of tabletags-<tags> conf section.
+        # Calculated parameters.
         self.abswidth=None      # 1..   (page units).
         self.pcwidth = None     # 1..99 (percentage).
         self.rows=[]            # Parsed rows, each row is a list of Cells.
         self.columns=[]         # List of Columns.
+        self.plans={}           # CellPlans keyed by column, style, row type.
+        self.lines=None         # Unread table source lines.
     @staticmethod
     def parse_align_spec(align_spec):
         """
@@ -3219,6 +4148,9 @@ class Table(AbstractBlock):
         separator = self.separator
         abswidth = float(config.pagewidth)
         pcwidth = 100.0
+        if self.attributes.get('datafile') and \
+                'format' not in self.attributes:
+            format = 'csv'  # Datafiles default to CSV.
         for k,v in self.attributes.items():
             if k == 'format':
                 if v not in self.FORMATS:
@@ -3238,6 +4170,9 @@ class Table(AbstractBlock):
                 else:
                     abswidth = float(v[:-1])/100 * config.pagewidth
                     pcwidth = float(v[:-1])
+        if self.attributes.get('datafile') and format == 'psv':
+            self.error('illegal datafile format=psv')
+            format = 'csv'
         # Calculate separator if it has not been specified.
         if not separator:
             separator = Table.SEPARATORS[format]
@@ -3370,19 +4305,18 @@ class Table(AbstractBlock):
             i += 1
         if cols:
             self.attributes['colspecs'] = writer.newline.join(cols)
-    def parse_rows(self, text):
+    def iter_rows(self, chunks):
         """
-        Parse the table source text into self.rows (a list of rows, each row
-        is a list of Cells.
+        Generate table rows (lists of Cells) from an iterable of lists of
+        consecutive table source text lines.
         """
         reserved = {}  # Reserved cells generated by rowspans.
         if self.parameters.format in ('psv','dsv'):
             colcount = len(self.columns)
-            parsed_cells = self.parse_psv_dsv(text)
+            parsed_cells = self.iter_psv_dsv(chunks)
             ri = 0  # Current row index 0..
             ci = 0  # Column counter 0..colcount
             row = []
-            i = 0
             while True:
                 resv = reserved.get(ri) and reserved[ri].get(ci)
                 if resv:
@@ -3391,10 +4325,9 @@ class Table(AbstractBlock):
                     # cell.
                     cell = resv
                 else:
-                    if i >= len(parsed_cells):
+                    cell = next_item(parsed_cells)
+                    if cell is None:
                         break   # No more parsed or reserved cells.
-                    cell = parsed_cells[i]
-                    i += 1
                     if cell.vspan > 1:
                         # Generate ensuing reserved cells spanned vertically by
                         # the current cell.
@@ -3406,16 +4339,23 @@ class Table(AbstractBlock):
                 if ci <= colcount:
                     row.append(cell)
                 if ci >= colcount:
-                    self.rows.append(row)
+                    yield row
+                    reserved.pop(ri, None)
                     ri += 1
                     row = []
                     ci = 0
         elif self.parameters.format == 'csv':
-            self.rows = self.parse_csv(text)
+            for row in self.iter_csv(chunks):
+                yield row
         else:
             assert True,'illegal table format'
-        # Check for empty rows containing only reserved (spanned) cells.
-        for ri,row in enumerate(self.rows):
+    def check_rows(self, rows):
+        """
+        Generate rows from the rows iterable checking for empty rows and
+        mismatched row spans along the way.
+        """
+        for ri,row in enumerate(rows):
+            # Check for empty rows containing only reserved (spanned) cells.
             empty = True
             for cell in row:
                 if not cell.reserved:
@@ -3423,8 +4363,7 @@ class Table(AbstractBlock):
                     break
             if empty:
                 message.warning('table row %d: empty spanned row' % (ri+1))
-        # Check that all row spans match.
-        for ri,row in enumerate(self.rows):
+            # Check that all row spans match.
             row_span = 0
             for cell in row:
                 row_span += cell.span
@@ -3434,6 +4373,7 @@ class Table(AbstractBlock):
                 message.warning('table row %d: does not span all columns' % (ri+1))
             if row_span > header_span:
                 message.warning('table row %d: exceeds columns span' % (ri+1))
+            yield row
     def subs_rows(self, rows, rowtype='body'):
         """
         Return a string of output markup from a list of rows, each row
@@ -3446,19 +4386,28 @@ class Table(AbstractBlock):
             rtag = tags.footrow
         else:
             rtag = tags.bodyrow
+        batched = self.batch_subs(rows, rowtype)
         result = []
         stag,etag = subs_tag(rtag,self.attributes)
         for row in rows:
             result.append(stag)
-            result += self.subs_row(row,rowtype)
+            result += self.subs_row(row,rowtype,batched)
             result.append(etag)
         return writer.newline.join(result)
-    def subs_row(self, row, rowtype):
+    def subs_row(self, row, rowtype, batched={}):
         """
         Substitute the list of Cells using the data tag.
         Returns a list of marked up table cell elements.
+        batched contains cell data substituted by batch_subs().
         """
         result = []
+        for cell,plan in self.iter_cell_plans(row, rowtype):
+            result += plan.render(cell, batched.get(id(cell)))
+        return result
+    def iter_cell_plans(self, row, rowtype):
+        """
+        Generate (Cell,CellPlan) tuples for the rendered cells in row.
+        """
         i = 0
         for cell in row:
             if cell.reserved:
@@ -3467,125 +4416,356 @@ class Table(AbstractBlock):
                 continue
             if i >= len(self.columns):
                 break   # Skip cells outside the header width.
-            col = self.columns[i]
-            self.attributes['halign'] = cell.halign or col.halign
-            self.attributes['valign'] = cell.valign or  col.valign
-            self.attributes['colabswidth'] = col.abswidth
-            self.attributes['colpcwidth'] = col.pcwidth
-            self.attributes['colnumber'] = str(i+1)
-            self.attributes['colspan'] = str(cell.span)
-            self.attributes['colstart'] = self.attributes['colnumber']
-            self.attributes['colend'] = str(i+cell.span)
-            self.attributes['rowspan'] = str(cell.vspan)
-            self.attributes['morerows'] = str(cell.vspan-1)
-            # Fill missing column data with blanks.
-            if i > len(self.columns) - 1:
-                data = ''
-            else:
-                data = cell.data
-            if rowtype == 'header':
-                # Use table style unless overriden by cell style.
-                colstyle = cell.style
-            else:
-                # If the cell style is not defined use the column style.
-                colstyle = cell.style or col.style
-            tags = self.get_tags(colstyle)
-            presubs,postsubs = self.get_subs(colstyle)
-            data = [data]
-            data = Lex.subs(data, presubs)
-            data = filter_lines(self.get_param('filter',colstyle),
-                                data, self.attributes)
-            data = Lex.subs(data, postsubs)
-            if rowtype != 'header':
-                ptag = tags.paragraph
-                if ptag:
-                    stag,etag = subs_tag(ptag,self.attributes)
-                    text = '\n'.join(data).strip()
-                    data = []
-                    for para in re.split(r'\n{2,}',text):
-                        data += dovetail_tags([stag],para.split('\n'),[etag])
-            if rowtype == 'header':
-                dtag = tags.headdata
-            elif rowtype == 'footer':
-                dtag = tags.footdata
-            else:
-                dtag = tags.bodydata
-            stag,etag = subs_tag(dtag,self.attributes)
-            result = result + dovetail_tags([stag],data,[etag])
+            key = (i, id(cell.style), rowtype)
+            plan = self.plans.get(key)
+            if plan is None:
+                plan = self.plans[key] = CellPlan(self, i, cell.style, rowtype)
+            yield cell,plan
             i += cell.span
+    def batch_subs(self, rows, rowtype):
+        """
+        Substitute the data of batchable cells from rows that share the same
+        presubs and postsubs in a single Lex.subs() pass, the cells are
+        joined by sentinel lines. Returns a dictionary of substituted cell
+        data lines keyed by cell id. Cells are left to per-cell substitution
+        if the batch does not split back into the original number of cells.
+        """
+        groups = {}
+        for row in rows:
+            for cell,plan in self.iter_cell_plans(row, rowtype):
+                if plan.is_batchable(cell.data) and \
+                        not plan.is_plain(cell.data):
+                    key = (tuple(plan.presubs or ()),
+                           tuple(plan.postsubs or ()))
+                    if key not in groups:
+                        groups[key] = (plan,[])
+                    groups[key][1].append(cell)
+        result = {}
+        for plan,cells in groups.values():
+            if len(cells) < 2:
+                continue
+            lines = []
+            for cell in cells:
+                if lines:
+                    lines.append(CellPlan.SENTINEL)
+                # Same lines as the per-cell Lex.subs() result.
+                lines += cell.data.splitlines()
+            lines = Lex.subs(lines, plan.presubs)
+            lines = Lex.subs(lines, plan.postsubs)
+            data = [[]]
+            for s in lines:
+                if s == CellPlan.SENTINEL:
+                    data.append([])
+                else:
+                    data[-1].append(s)
+            if len(data) != len(cells):
+                message.verbose('table cell batch substitution failed')
+                continue
+            for cell,lines in zip(cells,data):
+                result[id(cell)] = lines
         return result
     def parse_csv(self,text):
         """
         Parse the table source text and return a list of rows, each row
         is a list of Cells.
         """
-        import StringIO
+        return list(self.iter_csv([text]))
+    def iter_csv(self, chunks):
+        """
+        Generate CSV table rows (lists of Cells) from an iterable of lists of
+        consecutive table source text lines.
+        """
         import csv
-        rows = []
-        rdr = csv.reader(StringIO.StringIO('\r\n'.join(text)),
+        def lines():
+            # Same lines as iterating the CRLF joined text.
+            prev = None
+            for chunk in chunks:
+                for line in chunk:
+                    if prev is not None:
+                        yield prev + '\r\n'
+                    prev = line
+            if prev:
+                yield prev
+        rdr = csv.reader(lines(),
                      delimiter=self.parameters.separator, skipinitialspace=True)
+        row = []
         try:
             for row in rdr:
-                rows.append([Cell(data) for data in row])
+                yield [Cell(data) for data in row]
         except Exception:
             self.error('csv parse error: %s' % row)
-        return rows
     def parse_psv_dsv(self,text):
         """
         Parse list of PSV or DSV table source text lines and return a list of
         Cells.
         """
-        def append_cell(data, span_spec, op, align_spec, style):
+        return list(self.iter_psv_dsv([text]))
+    def iter_psv_dsv(self, chunks):
+        """
+        Generate PSV or DSV table Cells from an iterable of lists of
+        consecutive table source text lines. Separators must not span lines.
+        """
+        def new_cells(data, span_spec, op, align_spec, style):
             op = op or '+'
             if op == '*':   # Cell multiplier.
                 span = Table.parse_span_spec(span_spec)[0]
-                for i in range(span):
-                    cells.append(Cell(data, '1', align_spec, style))
+                return [Cell(data, '1', align_spec, style) for i in range(span)]
             elif op == '+': # Column spanner.
-                cells.append(Cell(data, span_spec, align_spec, style))
+                return [Cell(data, span_spec, align_spec, style)]
             else:
                 self.error('illegal table cell operator')
-        text = '\n'.join(text)
+                return []
+        def parse():
+            span = None
+            op = None
+            align = None
+            style = None
+            data = ''
+            lf = ''
+            for text in chunks:
+                # Chunks are joined by the newline ending the previous chunk.
+                text = lf + '\n'.join(text)
+                lf = '\n'
+                start = 0
+                for mo in reo.finditer(text):
+                    data += text[start:mo.start()]
+                    if data.endswith('\\'):
+                        data = data[:-1]+mo.group() # Reinstate escaped separators.
+                    else:
+                        for cell in new_cells(data, span, op, align, style):
+                            yield cell
+                        span = mo.groupdict().get('span')
+                        op = mo.groupdict().get('op')
+                        align = mo.groupdict().get('align')
+                        style = mo.groupdict().get('style')
+                        if style:
+                            style = self.get_style(style)
+                        data = ''
+                    start = mo.end()
+                data += text[start:]
+            # Last cell follows final separator.
+            for cell in new_cells(data, span, op, align, style):
+                yield cell
         separator = '(?msu)'+self.parameters.separator
-        format = self.parameters.format
-        start = 0
-        span = None
-        op = None
-        align = None
-        style = None
-        cells = []
-        data = ''
-        for mo in re.finditer(separator,text):
-            data += text[start:mo.start()]
-            if data.endswith('\\'):
-                data = data[:-1]+mo.group() # Reinstate escaped separators.
-            else:
-                append_cell(data, span, op, align, style)
-                span = mo.groupdict().get('span')
-                op = mo.groupdict().get('op')
-                align = mo.groupdict().get('align')
-                style = mo.groupdict().get('style')
-                if style:
-                    style = self.get_style(style)
-                data = ''
-            start = mo.end()
-        # Last cell follows final separator.
-        data += text[start:]
-        append_cell(data, span, op, align, style)
+        reo = re.compile(separator)
+        cells = parse()
         # We expect a dummy blank item preceeding first PSV cell.
-        if format == 'psv':
-            if cells[0].data.strip() != '':
-                self.error('missing leading separator: %s' % separator,
-                        self.start)
+        if self.parameters.format == 'psv':
+            for cell in cells:
+                if cell.data.strip() != '':
+                    self.error('missing leading separator: %s' % separator,
+                            self.start)
+                    yield cell
+                break
+        for cell in cells:
+            yield cell
+    def iter_lines(self):
+        """
+        Generate the table source lines up to (but not including) the closing
+        delimiter, lines are read as they are consumed.
+        """
+        reo = re.compile(self.delimiter)
+        while not reader.eof():
+            save_cursor = reader.cursor
+            s = reader.read()
+            if reo.match(s):
+                reader.unread(reader.cursor)
+                reader.cursor = save_cursor
+                return
+            yield s
+    def iter_chunks(self, line, lines):
+        """
+        Generate lists of STREAM_LINES table source lines from the first line
+        followed by the lines iterable.
+        """
+        chunk = [line]
+        for s in lines:
+            chunk.append(s)
+            if len(chunk) >= Table.STREAM_LINES:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    def read_closing_delimiter(self):
+        """Skip unread table source lines and the closing delimiter."""
+        if self.lines is None:
+            return
+        for s in self.lines:
+            pass
+        self.lines = None
+        if reader.eof():
+            self.error('missing closing delimiter',self.start)
+        else:
+            delimiter = reader.read()   # Discard closing delimiter.
+            assert re.match(self.delimiter,delimiter)
+    @staticmethod
+    def parse_ranges(spec):
+        """
+        Parse comma separated list of 1.. numbers and N-M, N- ranges.
+        Returns list of inclusive (first,last) tuples, last is None if the
+        range is open. Returns None if spec is illegal.
+        """
+        result = []
+        for s in spec.split(','):
+            mo = re.match(r'^\s*(\d+)\s*(?:(-)\s*(\d*)\s*)?$', s)
+            if not mo or int(mo.group(1)) < 1:
+                return None
+            first = int(mo.group(1))
+            if not mo.group(2):
+                last = first
+            elif mo.group(3):
+                last = int(mo.group(3))
+            else:
+                last = None
+            result.append((first,last))
+        return result
+    def iter_datafile(self, fname):
+        """
+        Generate the records (lists of field strings) of the CSV or DSV
+        formatted datafile. Blank lines are skipped and the 'datarows' and
+        'datacols' attributes select the records and fields.
+        """
+        rows = cols = None
+        for name in ('datarows','datacols'):
+            spec = self.attributes.get(name)
+            if spec:
+                ranges = Table.parse_ranges(spec)
+                if ranges is None:
+                    self.error('illegal %s=%s' % (name,spec))
+                elif name == 'datarows':
+                    rows = ranges
+                else:
+                    cols = []
+                    for first,last in ranges:
+                        if last is None:
+                            self.error('illegal %s=%s' % (name,spec))
+                            cols = None
+                            break
+                        cols += range(first-1, last)
+        maxrow = None
+        if rows and None not in [last for first,last in rows]:
+            maxrow = max([last for first,last in rows])
+        if reader.fname != '<stdin>':
+            fname = os.path.expandvars(os.path.expanduser(fname))
+            fname = safe_filename(fname, os.path.dirname(reader.fname))
+            if not fname:
+                return
+        manifest.add_file(fname)
+        if not os.path.isfile(fname):
+            # Same as a missing include file.
+            message.warning('[%s] missing datafile: %s' % (self.defname,fname))
+            return
+        message.verbose('datafile: %s' % fname, linenos=False)
+        encoding = self.attributes.get('dataencoding')
+        if encoding:
+            try:
+                codecs.lookup(encoding)
+            except LookupError:
+                self.error('illegal dataencoding=%s' % encoding)
+                return
+            f = codecs.open(fname, 'rb', encoding)
+            lines = (s.encode(char_encoding() or 'UTF-8') for s in f)
+        else:
+            f = open(fname, 'rb')
+            lines = f
+        import csv
+        try:
+            if self.parameters.format == 'csv':
+                records = csv.reader(lines, delimiter=self.parameters.separator,
+                                     skipinitialspace=True)
             else:
-                cells.pop(0)
-        return cells
+                records = ([cell.data for cell in
+                            self.parse_psv_dsv([s.rstrip('\r\n')])]
+                           for s in lines if s.strip())
+            ri = 0
+            try:
+                for record in records:
+                    if not record:
+                        continue
+                    ri += 1
+                    if ri == 1 and record[0].startswith('\xef\xbb\xbf'):
+                        record[0] = record[0][3:]   # Skip UTF-8 BOM.
+                    if rows:
+                        if maxrow is not None and ri > maxrow:
+                            break
+                        for first,last in rows:
+                            if first <= ri and (last is None or ri <= last):
+                                break
+                        else:
+                            continue
+                    if cols:
+                        record = [record[i] for i in cols if i < len(record)]
+                    yield record
+            except csv.Error, e:
+                self.error('csv parse error: %s: %s' % (fname, e))
+        finally:
+            f.close()
+    def is_streamable(self):
+        """
+        Return True if the table can be rendered as it is read i.e. the
+        template does not need the row count and the body rows are not
+        preceded by the footer row, and the separators do not span lines.
+        """
+        if 'footer' in self.parameters.options:
+            return False
+        for s in config.sections[self.parameters.template]:
+            if 'rowcount' in s:
+                return False
+        format = self.parameters.format
+        return format == 'csv' or 'datafile' in self.attributes or \
+                self.parameters.separator == Table.SEPARATORS[format]
+    def translate_stream(self, rows):
+        """
+        Render the table STREAM_ROWS rows at a time: the template is written
+        up to the body rows, the body rows are written as they are parsed
+        followed by the rest of the template.
+        """
+        rows = self.check_rows(rows)
+        # Rows can be empty lists so None flags the end of the rows.
+        row = next_item(rows)
+        headrows = None
+        if row is not None and 'header' in self.parameters.options:
+            headrows = self.subs_rows([row],'header')
+            self.attributes['headrows'] = '\x07headrows\x07'
+            row = next_item(rows)
+        if row is not None:
+            self.attributes['bodyrows'] = '\x07bodyrows\x07'
+        table = subs_attrs(config.sections[self.parameters.template],
+                           self.attributes)
+        table = writer.newline.join(table)
+        if headrows:
+            table = table.replace('\x07headrows\x07', headrows, 1)
+        if row is None or '\x07bodyrows\x07' not in table:
+            for row in rows:
+                pass    # Consume the remaining table data.
+            self.read_closing_delimiter()
+            writer.write(table,trace='table')
+            return
+        head,tail = table.split('\x07bodyrows\x07', 1)
+        if trace.active:
+            trace('table', head)
+        writer.write_part(head)
+        chunk = [row]
+        sep = ''
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= Table.STREAM_ROWS:
+                writer.write_part(sep + self.subs_rows(chunk))
+                chunk = []
+                sep = writer.newline
+        if chunk:
+            writer.write_part(sep + self.subs_rows(chunk))
+        self.read_closing_delimiter()
+        if trace.active:
+            trace('table', tail)
+        writer.write_part(tail, True)
     def translate(self):
         AbstractBlock.translate(self)
         reader.read()   # Discard delimiter.
         # Reset instance specific properties.
         self.columns = []
         self.rows = []
+        self.plans = {}
         attrs = {}
         BlockTitle.consume(attrs)
         # Mix in document attribute list.
@@ -3597,31 +4777,58 @@ class Table(AbstractBlock):
         self.attributes['pageunits'] = config.pageunits
         self.attributes['tableabswidth'] = int(self.abswidth)
         self.attributes['tablepcwidth'] = int(self.pcwidth)
-        # Read the entire table.
-        text = reader.read_until(self.delimiter)
-        if reader.eof():
-            self.error('missing closing delimiter',self.start)
+        self.lines = self.iter_lines()
+        datafile = self.attributes.get('datafile')
+        if datafile:
+            # The table data is read from the datafile.
+            for line in self.lines:
+                if line.strip():
+                    message.warning('[%s] datafile table content ignored'
+                            % self.defname)
+                    break
+            self.read_closing_delimiter()
+            records = self.iter_datafile(datafile)
+            record = next_item(records)
+            if record is None:
+                message.warning('[%s] table is empty' % self.defname)
+                return
         else:
-            delimiter = reader.read()   # Discard closing delimiter.
-            assert re.match(self.delimiter,delimiter)
-        if len(text) == 0:
-            message.warning('[%s] table is empty' % self.defname)
-            return
+            # Peek at the first line of the table.
+            line = next_item(self.lines)
+            if line is None:
+                self.read_closing_delimiter()
+                message.warning('[%s] table is empty' % self.defname)
+                return
         self.push_blockname('table')
         cols = attrs.get('cols')
         if not cols:
             # Calculate column count from number of items in first line.
-            if self.parameters.format == 'csv':
-                cols = text[0].count(self.parameters.separator) + 1
+            if datafile:
+                cols = len(record)
+            elif self.parameters.format == 'csv':
+                cols = line.count(self.parameters.separator) + 1
             else:
                 cols = 0
-                for cell in self.parse_psv_dsv(text[:1]):
+                for cell in self.parse_psv_dsv([line]):
                     cols += cell.span
         self.parse_cols(cols, attrs.get('halign'), attrs.get('valign'))
         # Set calculated attributes.
         self.attributes['colcount'] = len(self.columns)
         self.build_colspecs()
-        self.parse_rows(text)
+        for option in self.parameters.options:
+            self.attributes[option+'-option'] = ''
+        if datafile:
+            rows = ([Cell(data) for data in record] for record in
+                    itertools.chain([record], records))
+        else:
+            rows = self.iter_rows(self.iter_chunks(line, self.lines))
+        if self.is_streamable():
+            self.translate_stream(rows)
+            self.pop_blockname()
+            return
+        # Read the entire table.
+        self.rows = list(self.check_rows(rows))
+        self.read_closing_delimiter()
         # The 'rowcount' attribute is used by the experimental LaTeX backend.
         self.attributes['rowcount'] = str(len(self.rows))
         # Generate headrows, footrows, bodyrows.
@@ -3632,8 +4839,6 @@ class Table(AbstractBlock):
         # (the tab character does not appear elsewhere since it is expanded on
         # input) which are replaced after template attribute substitution.
         headrows = footrows = bodyrows = None
-        for option in self.parameters.options:
-            self.attributes[option+'-option'] = ''
         if self.rows and 'header' in self.parameters.options:
             headrows = self.subs_rows(self.rows[0:1],'header')
             self.attributes['headrows'] = '\x07headrows\x07'
@@ -3743,6 +4948,7 @@ class Macros:
         self.macros = []        # List of Macros.
         self.current = None     # The last matched block macro.
         self.passthroughs = []
+        self.matched = (None,None,[])   # Last match() (prefix,text,matches).
         # Initialize default system macro.
         m = Macro()
         m.pattern = self.SYS_RE
@@ -3750,6 +4956,7 @@ class Macros:
         m.reo = re.compile(m.pattern)
         self.macros.append(m)
     def load(self,entries):
+        self.matched = (None,None,[])
         for entry in entries:
             m = Macro()
             m.load(entry)
@@ -3809,14 +5016,21 @@ class Macros:
     def match(self,prefix,name,text):
         """Return re match object matching 'text' with macro type 'prefix',
         macro name 'name'."""
-        for m in self.macros:
-            if m.prefix == prefix:
-                mo = m.reo.match(text)
-                if mo:
-                    if m.name == name:
-                        return mo
-                    if re.match(name, mo.group('name')):
-                        return mo
+        # The reader matches each line with several system macro names so
+        # the macro matches for the last text are kept.
+        if self.matched[0] != prefix or self.matched[1] != text:
+            matches = []
+            for m in self.macros:
+                if m.prefix == prefix:
+                    mo = m.reo.match(text)
+                    if mo:
+                        matches.append((m,mo))
+            self.matched = (prefix,text,matches)
+        for m,mo in self.matched[2]:
+            if m.name == name:
+                return mo
+            if re.match(name, mo.group('name')):
+                return mo
         return None
     def extract_passthroughs(self,text,prefix=''):
         """ Extract the passthrough text and replace with temporary
@@ -3933,6 +5147,10 @@ class Macro:
                     # Substitute single quoted attribute values in block macros.
                     if self.prefix == '#':
                         AttributeList.subs(d)
+            if name in ('anchor','anchor2','anchor3'):
+                anchors.add_macro(name, d)
+            elif name in ('xref','xref2'):
+                anchors.add_xref(name, d)
             if name == 'callout':
                 listindex =int(d['index'])
                 d['coid'] = calloutmap.add(listindex)
@@ -3984,7 +5202,8 @@ class Macro:
             if self.has_passthrough():
                 s = macros.restore_passthroughs(s)
             if s:
-                trace('macro block',before,s)
+                if trace.active:
+                    trace('macro block',before,s)
                 writer.write(s)
 
     def subs_passthroughs(self, text, passthroughs):
@@ -4108,6 +5327,7 @@ class Reader1:
             self.f = open(fname,'rb')
             self.infile = fname
             self.indir = os.path.dirname(fname)
+            manifest.add_file(fname)
         document.attributes['infile'] = self.infile
         document.attributes['indir'] = self.indir
         self._lineno = 0            # The last line read from file object f.
@@ -4173,11 +5393,13 @@ class Reader1:
                     if not os.path.isfile(fname):
                         if warnings:
                             message.warning('include file not found: %s' % fname)
+                        manifest.add_file(fname)
                         return Reader1.read(self)   # Return next input line.
                     if mo.group('name') == 'include1':
                         if not config.dumping:
                             if fname not in config.include1:
                                 message.verbose('include1: ' + fname, linenos=False)
+                                manifest.add_file(fname)
                                 # Store the include file in memory for later
                                 # retrieval by the {include1:} system attribute.
                                 f = open(fname)
@@ -4261,6 +5483,7 @@ class Reader(Reader1):
         self.skip = False       # true if we're skipping ifdef...endif.
         self.skipname = ''      # Name of current endif macro target.
         self.skipto = -1        # The depth at which skipping is reenabled.
+        self.trusted = False    # Allow ifeval in safe mode (conf files).
     def read_super(self):
         result = Reader1.read(self,self.skip)
         if result is None and self.skip:
@@ -4319,7 +5542,7 @@ class Reader(Reader1):
                     else:
                         self.skip = defined
                 elif name == 'ifeval':
-                    if safe():
+                    if safe() and not self.trusted:
                         message.unsafe('ifeval invalid')
                         raise EAsciiDoc,'ifeval invalid safe document'
                     if not attrlist:
@@ -4328,7 +5551,7 @@ class Reader(Reader1):
                     attrlist = subs_attrs(attrlist)
                     if attrlist:
                         try:
-                            cond = eval(attrlist)
+                            cond = eval(compile_expression(attrlist))
                         except Exception,e:
                             raise EAsciiDoc,'error evaluating ifeval condition: %s: %s' % (result, str(e))
                         message.verbose('ifeval: %s: %r' % (attrlist, cond))
@@ -4426,11 +5649,14 @@ class Writer:
         http://en.wikipedia.org/wiki/Byte-order_mark
         '''
         self.fname = fname
-        if fname == '<stdout>':
+        if fname is None:
+            self.f = open(os.devnull,'wb')
+        elif fname == '<stdout>':
             self.f = sys.stdout
         else:
             self.f = open(fname,'wb+')
-        message.verbose('writing: '+writer.fname,False)
+        if fname is not None:
+            message.verbose('writing: '+writer.fname,False)
         if bom:
             self.f.write(bom)
         self.lines_out = 0
@@ -4441,12 +5667,19 @@ class Writer:
         if not (self.skip_blank_lines and (not line or not line.strip())):
             self.f.write((line or '') + self.newline)
             self.lines_out = self.lines_out + 1
+    def write_part(self, part, end=False):
+        """Write part of a line, if end is True the line is terminated.
+        Allows lines too large to build in memory to be written in parts."""
+        self.f.write(part)
+        if end:
+            self.f.write(self.newline)
+            self.lines_out = self.lines_out + 1
     def write(self,*args,**kwargs):
         """Iterates arguments, writes tuple and list arguments one line per
         element, else writes argument as single line. If no arguments writes
         blank line. If argument is None nothing is written. self.newline is
         appended to each line."""
-        if 'trace' in kwargs and len(args) > 0:
+        if trace.active and 'trace' in kwargs and len(args) > 0:
             trace(kwargs['trace'],args[0])
         if len(args) == 0:
             self.write_line()
@@ -4466,7 +5699,7 @@ class Writer:
             subs = config.subsnormal
         stag,etag = subs_tag(tag,d)
         content = Lex.subs(content,subs)
-        if 'trace' in kwargs:
+        if trace.active and 'trace' in kwargs:
             trace(kwargs['trace'],[stag]+content+[etag])
         if stag:
             self.write(stag)
@@ -4475,6 +5708,978 @@ class Writer:
         if etag:
             self.write(etag)
 
+class Manifest:
+    """
+    Records the files and commands the output document depends on. The
+    dependencies are written to a JSON build manifest next to the output
+    file by the --incremental option and the next build is skipped if none
+    of the dependencies have changed. Missing files are recorded too, so
+    creating one (e.g. a document specific conf file) triggers a rebuild.
+    Documents that use system attribute commands are always rebuilt because
+    the commands' output can change. There is a single global instance of
+    this class named manifest.
+    """
+    def __init__(self):
+        self.files = []     # Dependency file names in the order read.
+        self.commands = []  # Filter and system attribute commands.
+        self.args = []      # Command-line (option,value) pairs.
+        self.volatile = False   # True if the output depends on {sys:}.
+    def add_file(self, fname):
+        """Record dependency fname (which need not exist, a missing file
+        must still be missing for the output to be current)."""
+        if fname and fname != '<stdin>':
+            fname = os.path.realpath(fname)
+            if fname not in self.files:
+                self.files.append(fname)
+    def add_command(self, cmd):
+        if cmd not in self.commands:
+            self.commands.append(cmd)
+    @staticmethod
+    def file_hash(fname):
+        """Return SHA-1 hex digest of file contents or None if missing."""
+        if not os.path.isfile(fname):
+            return None
+        try:
+            from hashlib import sha1
+        except ImportError:
+            from sha import sha as sha1
+        h = sha1()
+        f = open(fname, 'rb')
+        try:
+            while True:
+                data = f.read(65536)
+                if not data:
+                    break
+                h.update(data)
+        finally:
+            f.close()
+        return h.hexdigest()
+    def manifest_file(self, outfile):
+        return outfile + '.deps'
+    def key(self):
+        """Build options that are not recorded as file dependencies."""
+        return {'version': VERSION,
+                'args': [[o,v] for o,v in self.args]}
+    def is_current(self, outfile):
+        """
+        Return True if outfile was built from the current dependencies
+        according to its build manifest.
+        """
+        fname = self.manifest_file(outfile)
+        if not os.path.isfile(outfile) or not os.path.isfile(fname):
+            return False
+        import json
+        try:
+            f = open(fname)
+            try:
+                deps = json.load(f)
+            finally:
+                f.close()
+            for k,v in self.key().items():
+                if deps.get(k) != v:
+                    return False
+            if deps.get('volatile'):
+                message.verbose('system attribute output: %s' % outfile,
+                        False)
+                return False
+            for name,digest in deps['files']:
+                if self.file_hash(name) != digest:
+                    message.verbose('changed: %s' % name, False)
+                    return False
+        except (IOError,ValueError,KeyError,TypeError):
+            message.warning('illegal build manifest: %s' % fname, False)
+            return False
+        return True
+    def write(self, outfile):
+        """Write the build manifest for outfile."""
+        import json
+        fname = self.manifest_file(outfile)
+        for f in config.loaded:
+            self.add_file(f)
+        deps = self.key()
+        deps['files'] = [[f,self.file_hash(f)] for f in self.files]
+        deps['commands'] = self.commands
+        deps['volatile'] = self.volatile
+        message.verbose('writing: %s' % fname, False)
+        f = open(fname, 'w')
+        try:
+            json.dump(deps, f, indent=1, sort_keys=True)
+            f.write('\n')
+        finally:
+            f.close()
+    def remove(self, outfile):
+        """Delete outfile's build manifest (forces a rebuild)."""
+        fname = self.manifest_file(outfile)
+        if os.path.isfile(fname):
+            os.unlink(fname)
+
+class Watcher:
+    """
+    Implements the --watch option. The watch engine process loads the
+    global configuration once and then forks a child process to convert the
+    document each time the document or its dependencies change. The engine
+    re-executes itself if a globally loaded conf file changes. There is a
+    single global instance of this class named watcher.
+    """
+    INTERVAL = 0.5      # Seconds between file modification checks.
+    def __init__(self):
+        self.pipe = None    # Conversion child's dependencies pipe.
+        self.outfile = None # Conversion child's output file name.
+    @staticmethod
+    def mtimes(files):
+        """Return dictionary of file modification times (None if missing)."""
+        result = {}
+        for f in files:
+            try:
+                result[f] = os.path.getmtime(f)
+            except OSError:
+                result[f] = None
+        return result
+    def run(self, infile, confiles):
+        """
+        Run the watch engine loop, only returns in the forked conversion child
+        process. 'confiles' are the command-line conf files.
+        """
+        import json, atexit
+        if __name__ != '__main__' or not hasattr(os, 'fork'):
+            raise EAsciiDoc,'--watch is not supported'
+        if infile == '<stdin>':
+            raise EAsciiDoc,'--watch requires an input file'
+        # Files that invalidate the globally loaded configuration.
+        conffiles = config.loaded + [os.path.realpath(f) for f in confiles]
+        conffiles.append(os.path.realpath(
+                os.path.join(os.path.dirname(infile), 'asciidoc.conf')))
+        while True:
+            r,w = os.pipe()
+            started = time.time()
+            pid = os.fork()
+            if pid == 0:
+                os.close(r)
+                self.pipe = w
+                atexit.register(self.report)
+                return
+            os.close(w)
+            f = os.fdopen(r)
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            status = os.waitpid(pid, 0)[1]
+            elapsed = (time.time() - started) * 1000
+            try:
+                deps = json.loads(data)
+            except ValueError:
+                deps = {'files': [infile], 'outfile': None}
+            if status == 0:
+                result = 'converted'
+            else:
+                result = 'failed'
+            message.stderr('%s: %s in %d ms' % (
+                    os.path.basename(deps['outfile'] or infile),
+                    result, elapsed))
+            files = set(deps['files']) | set(conffiles)
+            files.add(os.path.realpath(infile))
+            mtimes = self.mtimes(files)
+            while True:
+                time.sleep(self.INTERVAL)
+                changed = [f for f,t in self.mtimes(files).items()
+                           if t != mtimes[f]]
+                if changed:
+                    break
+            for f in changed:
+                message.verbose('changed: %s' % f, False)
+            if set(changed) & set(conffiles):
+                message.stderr('reloading configuration')
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os.execv(sys.executable, [sys.executable] + sys.argv)
+    def report(self):
+        """Send the dependencies to the watch engine (conversion child)."""
+        import json
+        if self.pipe is None:
+            return  # Multiple backend conversion child.
+        f = os.fdopen(self.pipe, 'w')
+        try:
+            json.dump({'files': manifest.files + config.loaded,
+                       'outfile': self.outfile}, f)
+        finally:
+            f.close()
+
+class MultiBackend:
+    """
+    Implements multiple comma separated -b option backends. The global
+    configuration is loaded once and then a child process is forked to
+    convert the document to each backend in turn (c.f. Watcher). Each child
+    sends the backend independent results of its conversion (filter and
+    {sys:} outputs, the parsed document elements and the dependencies) to
+    the parent process which passes them on to the following children.
+    There is a single global instance of this class named multibackend.
+    """
+    def __init__(self):
+        self.backends = []  # The backends (empty if one backend).
+        self.pipe = None    # Conversion child's results pipe.
+    def run(self, backends, infile, outfile):
+        """
+        Convert the document to each backend, only returns the backend in
+        the forked conversion child processes.
+        """
+        import atexit
+        if __name__ != '__main__' or not hasattr(os, 'fork'):
+            raise EAsciiDoc,'multiple backends are not supported'
+        if infile == '<stdin>':
+            raise EAsciiDoc,'multiple backends require an input file'
+        if outfile is not None:
+            raise EAsciiDoc,'multiple backends require default output files'
+        for backend in backends:
+            if not backend:
+                raise EAsciiDoc,'illegal backend list'
+        self.backends = backends
+        status = 0
+        outfiles = []
+        for backend in backends:
+            r,w = os.pipe()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                os.close(r)
+                self.pipe = w
+                if watcher.pipe is not None:
+                    # The parent reports to the watch engine.
+                    os.close(watcher.pipe)
+                    watcher.pipe = None
+                atexit.register(self.report)
+                return backend
+            os.close(w)
+            f = os.fdopen(r)
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            if os.waitpid(pid, 0)[1]:
+                status = 1
+            try:
+                results = json_decode(data)
+                self.load(results)
+            except (ValueError,KeyError):
+                continue
+            if results['outfile'] in outfiles:
+                message.warning('%s backend overwrote output file: %s'
+                        % (backend, results['outfile']), False)
+            outfiles.append(results['outfile'])
+        sys.exit(status)
+    def report(self):
+        """Send the conversion results to the parent (conversion child)."""
+        results = {'outfile': document.outfile,
+            'files': manifest.files + config.loaded,
+            'filters': [[k[0],list(k[1]),v] for k,v in filter_outputs.items()],
+            'sys': [list(k)+[v] for k,v in sys_outputs.items()],
+            'parsecache': None}
+        if parsecache.active:
+            results['parsecache'] = parsecache.dump()
+        f = os.fdopen(self.pipe, 'w')
+        try:
+            f.write(json_encode(results))
+        finally:
+            f.close()
+    def load(self, results):
+        """Load the results sent by a conversion child."""
+        for fname in results['files']:
+            manifest.add_file(fname)
+        for cmd,lines,output in results['filters']:
+            filter_outputs[(cmd,tuple(lines))] = output
+        for name,cwd,cmd,lines in results['sys']:
+            sys_outputs[(name,cwd,cmd)] = lines
+        if results['parsecache'] is not None:
+            parsecache.cache = results['parsecache']
+
+class Parallel:
+    """
+    Implements the --jobs option. The document header and preamble are
+    written by the parent process which then translates the rest of the
+    document in --check mode (output discarded, no filters) and forks a
+    worker process at each top-level section boundary to write the sections
+    up to the next boundary. The shared document state (attributes, section
+    numbers, IDs, callout list numbers) is inherited by the workers. When
+    the state each worker finishes with matches the parent's state at the
+    following boundary the worker outputs are concatenated in document
+    order, otherwise the sections are written by a serial conversion process
+    forked at the first boundary.
+    There is a single global instance of this class named parallel.
+    """
+    def __init__(self):
+        self.jobs = 1           # Number of worker processes.
+        self.tmpdir = None      # Worker outputs directory.
+        self.states = []        # Parent state digests at each boundary.
+        self.pids = {}          # Running worker pids (value = chunk number).
+        self.status = []        # Worker exit status (indexed by chunk number).
+        self.worker = None      # Chunk number in worker processes.
+        self.serial = None      # Serial conversion process pid.
+        self.go = None          # Serial conversion process (read,write) pipe.
+        self.saved = None       # Parent's (writer.f,sys.stderr,has_errors,has_warnings).
+    @staticmethod
+    def state():
+        """Return a digest of the document state that must be the same in
+        the parent and the workers at section boundaries."""
+        try:
+            from hashlib import sha1
+        except ImportError: # DEPRECATED: Python 2.4 compatibility.
+            from sha import sha as sha1
+        state = (sorted(document.attributes.items()),
+                 Title.section_numbers, document.level, Section.endtags,
+                 sorted(anchors.ids.keys()), sorted(anchors.suffixes.items()),
+                 calloutmap.listnumber, calloutmap.calloutindex,
+                 sorted(calloutmap.comap.items()),
+                 sorted(AttributeList.attrs.items()), BlockTitle.title,
+                 reader.next and reader.next[0][:2])
+        return sha1(repr(state)).hexdigest()
+    def start(self):
+        """Start parallel translation at the first boundary, returns False
+        if the document cannot be translated in parallel."""
+        if __name__ != '__main__' or not hasattr(os, 'fork') \
+                or config.checking or parsecache.active:
+            return False
+        readers = []
+        r = reader
+        while r:
+            if r.fname == '<stdin>':
+                return False
+            readers.append(r)
+            r = r.parent
+        self.tmpdir = tempfile.mkdtemp(prefix='asciidoc-')
+        self.go = os.pipe()
+        pid = self.fork(readers)
+        if pid == 0:
+            # Serial conversion process, wait for the parent's go ahead.
+            self.serial = True
+            os.close(self.go[1])
+            if os.read(self.go[0], 1) != '1':
+                os._exit(0)
+            os.close(self.go[0])
+            return True
+        self.serial = pid
+        os.close(self.go[0])
+        # Translate the remaining document in --check mode.
+        self.saved = (writer.f, sys.stderr,
+                      document.has_errors, document.has_warnings)
+        config.checking = True
+        writer.f = open(os.devnull, 'wb')
+        sys.stderr = open(os.devnull, 'w')
+        return True
+    def fork(self, readers):
+        """Fork a child process, the child's input files are reopened so
+        they don't share file positions with the parent."""
+        positions = [(r, r.f.tell()) for r in readers]
+        writer.f.flush()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            for r,pos in positions:
+                r.f = open(r.fname, 'rb')
+                r.f.seek(pos)
+        return pid
+    def split(self, final=False):
+        """Called at top-level section boundaries and at the end of the
+        document (final=True)."""
+        if self.worker is not None:
+            if final or self.serial is not True:
+                self.finish()
+            return
+        if self.tmpdir is None:
+            if final or not self.start():
+                self.jobs = 1
+                return
+            if self.serial is True:
+                self.worker = 0
+                return
+        self.states.append(self.state())
+        if final:
+            self.join()
+            return
+        while len(self.pids) >= self.jobs:
+            self.wait()
+        readers = []
+        r = reader
+        while r:
+            readers.append(r)
+            r = r.parent
+        chunk = len(self.status)
+        self.status.append(None)
+        pid = self.fork(readers)
+        if pid == 0:
+            self.worker = chunk
+            os.close(self.go[1])
+            fname = os.path.join(self.tmpdir, '%d.err' % chunk)
+            fd = os.open(fname, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0666)
+            os.dup2(fd, 2)
+            os.close(fd)
+            writer.f, sys.stderr = self.saved[:2]
+            writer.f = open(os.path.join(self.tmpdir, '%d.out' % chunk), 'wb')
+            config.checking = False
+        else:
+            self.pids[pid] = chunk
+    def finish(self):
+        """Write the worker's results and exit (worker processes)."""
+        if self.serial is True:
+            fname = os.path.join(self.tmpdir, 'serial.json')
+            writer.f.flush()
+        else:
+            fname = os.path.join(self.tmpdir, '%d.json' % self.worker)
+            writer.f.close()
+        results = {'state': self.state(),
+                   'errors': document.has_errors,
+                   'warnings': document.has_warnings,
+                   'files': manifest.files}
+        f = open(fname, 'w')
+        try:
+            f.write(json_encode(results))
+        finally:
+            f.close()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(0)
+    def abort(self):
+        """Called when the translation fails: workers exit, the parent is
+        restored."""
+        if self.worker is not None:
+            sys.stderr.flush()
+            os._exit(1)
+        if self.saved is not None:
+            config.checking = False
+            writer.f, sys.stderr = self.saved[:2]
+            self.saved = None
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+    def wait(self):
+        """Wait for a worker process to exit."""
+        pid,status = os.waitpid(-1, 0)
+        if pid in self.pids:
+            self.status[self.pids.pop(pid)] = status
+        elif pid == self.serial:
+            self.serial = None
+    def results(self, fname):
+        """Return worker results file contents or None."""
+        try:
+            f = open(os.path.join(self.tmpdir, fname), 'rb')
+            try:
+                return f.read()
+            finally:
+                f.close()
+        except IOError:
+            return None
+    def join(self):
+        """Wait for the workers and write their outputs (parent process)."""
+        while self.pids:
+            self.wait()
+        config.checking = False
+        writer.f.close()
+        sys.stderr.close()
+        writer.f, sys.stderr, document.has_errors, document.has_warnings \
+                = self.saved
+        self.saved = None
+        try:
+            chunks = []
+            for i in range(len(self.status)):
+                results = self.results('%d.json' % i)
+                if self.status[i] != 0 or results is None:
+                    break
+                results = json_decode(results)
+                if results['state'] != self.states[i+1]:
+                    break
+                chunks.append(results)
+            if len(chunks) == len(self.status):
+                w = '0'
+            else:
+                message.verbose('parallel translation mismatch at '
+                        'section %d: translating serially' % (len(chunks)+1),
+                        False)
+                chunks = []
+                w = '1'
+            if self.serial:
+                os.write(self.go[1], w)
+                os.close(self.go[1])
+                os.waitpid(self.serial, 0)
+            if w == '1':
+                results = self.results('serial.json')
+                if results is None:
+                    raise EAsciiDoc,'serial translation failed'
+                chunks = [json_decode(results)]
+            for i,results in enumerate(chunks):
+                if w == '0':
+                    writer.f.write(self.results('%d.out' % i))
+                    sys.stderr.write(self.results('%d.err' % i))
+                if results['errors']:
+                    document.has_errors = True
+                if results['warnings']:
+                    document.has_warnings = True
+                for fname in results['files']:
+                    manifest.add_file(fname)
+        finally:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
+
+class Profiler:
+    """
+    Implements the --profile option. When started the processing phases
+    (configuration loading, header parsing, translation, writing), the
+    element translate() methods, the substitution functions, filter_lines()
+    and system() are replaced by wrappers that record the number of calls
+    and their wall clock and CPU times. Self times exclude the time spent in
+    nested profiled calls. There is a single global instance of this class
+    named profiler.
+    """
+    CATEGORIES = ('phase','element','subs','filter','system')
+    def __init__(self):
+        self.fname = None   # JSON profile file name.
+        self.stats = {}     # [calls,wall,cpu,self wall,self cpu] keyed by (category,name).
+        self.stack = []     # Running [key,wall,cpu,nested wall,nested cpu].
+        self.started = None # (wall,cpu) when profiling started.
+    @staticmethod
+    def now():
+        """Return (wall,cpu) times, CPU time includes terminated child
+        processes (filters)."""
+        t = os.times()
+        return time.time(), t[0] + t[1] + t[2] + t[3]
+    def begin(self, key):
+        wall,cpu = self.now()
+        self.stack.append([key, wall, cpu, 0.0, 0.0])
+    def end(self):
+        wall,cpu = self.now()
+        key,wall0,cpu0,nested_wall,nested_cpu = self.stack.pop()
+        wall -= wall0
+        cpu -= cpu0
+        stats = self.stats.setdefault(key, [0, 0.0, 0.0, 0.0, 0.0])
+        stats[0] += 1
+        if key not in [t[0] for t in self.stack]:
+            # Recursive calls are included in the outermost call's times.
+            stats[1] += wall
+            stats[2] += cpu
+        stats[3] += wall - nested_wall
+        stats[4] += cpu - nested_cpu
+        if self.stack:
+            self.stack[-1][3] += wall
+            self.stack[-1][4] += cpu
+    def wrap(self, category, func, name):
+        """Return profiled func, name is a string or a function that returns
+        the name from func's arguments (calls named None are not
+        profiled)."""
+        def wrapper(*args, **kwargs):
+            if callable(name):
+                key = (category, name(*args, **kwargs))
+                if key[1] is None:
+                    return func(*args, **kwargs)
+            else:
+                key = (category, name)
+            self.begin(key)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.end()
+        return wrapper
+    def patch(self, obj, attr, category, name):
+        """Replace obj.attr (function, method or staticmethod) with a
+        profiled wrapper."""
+        func = getattr(obj, attr)
+        if isinstance(obj, type) or type(obj).__name__ == 'classobj':
+            if isinstance(obj.__dict__.get(attr), staticmethod):
+                setattr(obj, attr,
+                        staticmethod(self.wrap(category, func, name)))
+                return
+            func = obj.__dict__[attr]
+        setattr(obj, attr, self.wrap(category, func, name))
+    def start(self, fname):
+        """Install the profiling wrappers."""
+        self.fname = fname
+        self.started = self.now()
+        g = globals()
+        for obj,attr,name in (
+                (Config, 'load_file', 'conf'),
+                (Document, 'parse_header', 'header'),
+                (Document, 'translate', 'translate'),
+                (Lex, 'next', 'scan'),
+                (Writer, 'write_line', 'write'),
+                (Writer, 'write_part', 'write')):
+            self.patch(obj, attr, 'phase', name)
+        for cls in (Section, FloatingTitle, AttributeEntry, AttributeList,
+                    BlockTitle, Paragraph, List, DelimitedBlock, Table,
+                    Table_OLD, Macro):
+            self.patch(cls, 'translate', 'element', cls.__name__)
+        self.patch(config, 'subs_specialchars', 'subs', 'specialcharacters')
+        self.patch(config, 'subs_specialwords', 'subs', 'specialwords')
+        self.patch(config, 'subs_replacements', 'subs',
+                lambda s,sect='replacements': sect)
+        self.patch(macros, 'subs', 'subs',
+                lambda text,prefix='',callouts=False:
+                    callouts and 'callouts' or 'macros')
+        for func,name in (('subs_attrs','attributes'),
+                          ('subs_quotes','quotes')):
+            g[func] = self.wrap('subs', g[func], name)
+        g['filter_lines'] = self.wrap('filter', g['filter_lines'],
+                lambda filter_cmd,lines,attrs={}: filter_cmd or None)
+        g['system'] = self.wrap('system', g['system'],
+                lambda name,args,is_macro=False,attrs=None: name)
+    def summary(self):
+        """Return the profile as a list of dictionaries in category and
+        descending self time order."""
+        result = []
+        for (category,name),stats in self.stats.items():
+            result.append({'category': category, 'name': name,
+                'calls': stats[0], 'wall': stats[1], 'cpu': stats[2],
+                'self_wall': stats[3], 'self_cpu': stats[4]})
+        result.sort(key=lambda d: (self.CATEGORIES.index(d['category']),
+                                   -d['self_wall']))
+        return result
+    def report(self):
+        """Print the profile summary to stderr and write the JSON profile
+        file."""
+        import json
+        wall,cpu = self.now()
+        wall -= self.started[0]
+        cpu -= self.started[1]
+        summary = self.summary()
+        message.stderr('profile: %-9s %-30s %7s %9s %9s %9s %9s' %
+                ('category','name','calls','wall','cpu','self wall','self cpu'))
+        for d in summary:
+            name = d['name']
+            if len(name) > 30:
+                name = name[:27] + '...'
+            message.stderr('profile: %-9s %-30s %7d %9.3f %9.3f %9.3f %9.3f' %
+                    (d['category'], name, d['calls'], d['wall'], d['cpu'],
+                     d['self_wall'], d['self_cpu']))
+        message.stderr('profile: %-9s %-30s %7s %9.3f %9.3f' %
+                ('total', '', '', wall, cpu))
+        fname = self.fname
+        if multibackend.backends:
+            # Each backend's conversion child writes its own profile.
+            fname,ext = os.path.splitext(fname)
+            fname = '%s-%s%s' % (fname, document.backend, ext)
+        message.verbose('writing: %s' % fname, False)
+        f = open(fname, 'w')
+        try:
+            json.dump({'infile': document.infile, 'outfile': document.outfile,
+                       'backend': document.backend, 'wall': wall, 'cpu': cpu,
+                       'profile': summary},
+                      f, indent=1, sort_keys=True, encoding='latin-1')
+            f.write('\n')
+        finally:
+            f.close()
+
+class Server:
+    """
+    Implements the --serve option: a conversion server listening on a Unix
+    domain socket. Requests are handled by a pool of pre-forked worker
+    processes. Each worker keeps zygote processes with the global
+    configuration loaded for recently used command options, a zygote forks a
+    child process to convert each request (c.f. Watcher). There is a single
+    global instance of this class named server.
+
+    Requests and responses are JSON objects (byte strings are sent as
+    Latin-1 JSON strings, a lossless byte mapping). A request contains the
+    command-line 'args', the current working directory 'cwd' and the
+    standard 'input' (or null). A response contains the exit 'status', the
+    standard 'output', the 'stderr' text and the 'messages' list, or just
+    'local' if the client must run asciidoc(1) itself (see is_local()).
+
+    The socket is only accessible by the server's user and requests are
+    converted in safe mode unless the server was started with --unsafe.
+    """
+    WORKERS = 4     # Default number of worker processes.
+    ZYGOTES = 8     # Maximum number of zygotes per worker.
+    # Options the client runs locally.
+    LOCAL_OPTIONS = ('-h','--help','--version','--doctest','--watch',
+                     '--serve','--workers','--jobs','--profile')
+    def __init__(self):
+        self.unsafe = False     # Convert requests in unsafe mode.
+        self.sock = None        # Zygote's worker connection.
+        self.forked = False     # True in conversion child processes.
+        self.stdout = None      # Captured standard output.
+        self.stderr = None      # Captured standard error.
+    def serve(self, path, workers=None, unsafe=False):
+        """Run the server master process (does not return)."""
+        import socket, signal
+        if os.path.exists(path):
+            # Remove socket left by a server that is no longer running.
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                try:
+                    s.connect(path)
+                except socket.error:
+                    os.unlink(path)
+                else:
+                    die('server already running: %s' % path)
+            finally:
+                s.close()
+        self.unsafe = unsafe
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0177)  # Create the socket with mode 0600.
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(umask)
+        sock.listen(64)
+        message.stderr('listening: %s' % path)
+        def terminate(signum, frame):
+            raise SystemExit
+        signal.signal(signal.SIGTERM, terminate)
+        pids = []
+        try:
+            while True:
+                while len(pids) < (workers or self.WORKERS):
+                    pid = os.fork()
+                    if pid == 0:
+                        signal.signal(signal.SIGINT, signal.SIG_IGN)
+                        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                        try:
+                            self.worker(sock)
+                        finally:
+                            os._exit(1)
+                    pids.append(pid)
+                pid = os.wait()[0]
+                if pid in pids:
+                    pids.remove(pid)
+        except (KeyboardInterrupt,SystemExit):
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+        finally:
+            sock.close()
+            if os.path.exists(path):
+                os.unlink(path)
+        sys.exit(0)
+    def worker(self, sock):
+        """Worker process request loop."""
+        import socket
+        zygotes = []    # (key,pid,sock,file) tuples, least recently used first.
+        while True:
+            conn = sock.accept()[0]
+            try:
+                chunks = []
+                while True:
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    chunks.append(data)
+                try:
+                    request = json_decode(''.join(chunks))
+                    local = self.is_local(request['args'])
+                    if not local:
+                        key = self.key(request)
+                except Exception:
+                    response = json_encode({'status': 1, 'output': '',
+                        'stderr': '%s: FAILED: illegal request: %s%s' %
+                        (message.PROG, sys.exc_info()[1], os.linesep),
+                        'messages': []})
+                else:
+                    if local:
+                        response = json_encode({'local': True})
+                    else:
+                        response = self.convert(request, key, zygotes,
+                                                (sock,conn))
+                conn.sendall(response.rstrip('\n'))
+            except socket.error:
+                pass    # Client went away.
+            finally:
+                conn.close()
+    def convert(self, request, key, zygotes, sockets):
+        """Convert the request in a zygote process, returns JSON response.
+        The worker's 'sockets' are closed in new zygotes."""
+        def release(zygote):
+            zygotes.remove(zygote)
+            zygote[2].close()
+            zygote[3].close()
+            os.waitpid(zygote[1], 0)
+        response = None
+        for zygote in zygotes:
+            if zygote[0] == key:
+                break
+        else:
+            zygote = None
+        for retry in (True,False):
+            if zygote is None:
+                if len(zygotes) >= self.ZYGOTES:
+                    release(zygotes[0])
+                zygote = self.spawn(key, sockets)
+            else:
+                zygotes.remove(zygote)
+            zygotes.append(zygote)
+            try:
+                zygote[2].sendall(json_encode(request) + '\n')
+                response = zygote[3].readline()
+            except (IOError,OSError):
+                response = ''
+            if response:
+                obj = json_decode(response)
+                if obj.get('reload'):
+                    response = ''
+                elif obj.get('exit'):
+                    release(zygote)
+                    break
+                else:
+                    break
+            release(zygote)
+            zygote = None
+        if not response:
+            response = json_encode({'status': 1, 'output': '',
+                'stderr': '%s: FAILED: conversion process failed%s'
+                % (message.PROG, os.linesep), 'messages': []})
+        return response
+    @staticmethod
+    def is_local(args):
+        """Return True if the request args must be run locally by the client
+        (options that are not allowed in requests and --unsafe if the server
+        is not unsafe)."""
+        import getopt
+        try:
+            opts,args = getopt.getopt(args, OPTIONS, LONG_OPTIONS)
+        except getopt.GetoptError:
+            return True
+        if len(args) != 1:
+            return True
+        for o,v in opts:
+            if o in Server.LOCAL_OPTIONS:
+                return True
+            if o == '--unsafe' and not server.unsafe:
+                return True
+            if o in ('-b','--backend','--filter','--theme') and \
+                    v in Plugin.CMDS:
+                return True
+            if o in ('-b','--backend') and ',' in v:
+                return True     # Multiple backends.
+        return False
+    @staticmethod
+    def parse_args(args):
+        """Parse request args, returns getopt() (opts,args) tuple. Requests
+        are converted in safe mode unless the server is unsafe."""
+        import getopt
+        opts,args = getopt.getopt(args, OPTIONS, LONG_OPTIONS)
+        for o,v in opts:
+            if o in Server.LOCAL_OPTIONS:
+                raise EAsciiDoc,'%s option not allowed' % o
+            if o in ('-b','--backend') and ',' in v:
+                raise EAsciiDoc,'multiple backends not allowed'
+        if not server.unsafe:
+            opts = [(o,v) for o,v in opts if o != '--unsafe']
+            opts.append(('--safe',''))
+        return opts,args
+    def key(self, request):
+        """Return the zygote key for the request (options that change the
+        globally loaded configuration)."""
+        opts,args = self.parse_args(request['args'])
+        opts = [(o,v) for o,v in opts if o not in ('-o','--out-file')]
+        if not args:
+            indir = ''
+        elif args[0] == '-':
+            indir = None
+        else:
+            indir = os.path.dirname(os.path.join(request['cwd'], args[0]))
+        return (repr(opts), request['cwd'], indir)
+    def spawn(self, key, sockets):
+        """Fork a zygote process, returns zygote tuple. The worker's
+        'sockets' are closed in the zygote."""
+        import socket
+        s1,s2 = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            s1.close()
+            for s in sockets:
+                s.close()
+            self.sock = s2
+            f = s2.makefile('r')
+            request = json_decode(f.readline())
+            self.zygote_file = f
+            status = self.run(request)
+            # Reached after a conversion child has finished or if the zygote
+            # failed before the configuration was loaded.
+            self.respond(status)
+            os._exit(0)
+        s2.close()
+        return (key, pid, s1, s1.makefile('r'))
+    def setup(self, request):
+        """Set up the environment for request conversion."""
+        import StringIO
+        os.chdir(request['cwd'])
+        self.stdout = sys.stdout = StringIO.StringIO()
+        self.stderr = sys.stderr = StringIO.StringIO()
+        sys.stdin = StringIO.StringIO(request.get('input') or '')
+        del message.messages[:]
+        message.prev_msg = ''
+    def run(self, request):
+        """Execute the request in the zygote, returns exit status."""
+        self.setup(request)
+        try:
+            opts,args = self.parse_args(request['args'])
+            execute(sys.argv[0], opts, args)
+        except SystemExit, e:
+            if isinstance(e.code, int):
+                return e.code
+            return e.code is not None and 1 or 0
+        except Exception:
+            message.stderr('FAILED: %s' % sys.exc_info()[1])
+            return 1
+        return 0
+    def respond(self, status):
+        """Send the conversion response to the worker."""
+        response = {'status': status,
+                    'output': self.stdout.getvalue(),
+                    'stderr': self.stderr.getvalue(),
+                    'messages': message.messages}
+        if not self.forked:
+            response['exit'] = True
+        self.sock.sendall(json_encode(response) + '\n')
+    def fork(self, infile, outfile, confiles):
+        """
+        Run the zygote request loop, only returns (infile,outfile) in the
+        forked conversion child process. 'confiles' are the command-line
+        conf files.
+        """
+        conffiles = config.loaded + [os.path.realpath(f) for f in confiles]
+        if infile != '<stdin>':
+            conffiles.append(os.path.realpath(
+                os.path.join(os.path.dirname(infile), 'asciidoc.conf')))
+        mtimes = Watcher.mtimes(conffiles)
+        first = True
+        while True:
+            if not first:
+                line = self.zygote_file.readline()
+                if not line:
+                    os._exit(0)
+                if Watcher.mtimes(conffiles) != mtimes:
+                    self.sock.sendall(json_encode({'reload': True}) + '\n')
+                    os._exit(0)
+                request = json_decode(line)
+                self.setup(request)
+                opts,args = self.parse_args(request['args'])
+                infile,outfile = args[0],None
+                for o,v in opts:
+                    if o in ('-o','--out-file'):
+                        outfile = v
+                if infile == '-':
+                    infile = '<stdin>'
+                else:
+                    infile = os.path.abspath(infile)
+                if outfile == '-':
+                    outfile = '<stdout>'
+                elif outfile is not None:
+                    outfile = os.path.abspath(outfile)
+                elif infile == '<stdin>':
+                    outfile = '<stdout>'
+            pid = os.fork()
+            if pid == 0:
+                self.forked = True
+                return infile,outfile
+            status = os.waitpid(pid, 0)[1]
+            if status:
+                # The child did not respond.
+                self.forked = True
+                self.stderr.write('%s: FAILED: conversion process terminated%s'
+                                  % (message.PROG, os.linesep))
+                self.respond(1)
+                self.forked = False
+            first = False
+
 #---------------------------------------------------------------------------
 # Configuration file processing.
 #---------------------------------------------------------------------------
@@ -4542,6 +6747,9 @@ class Config:
         self.loaded = []        # Loaded conf files.
         self.include1 = {}      # Holds include1::[] files for {include1:}.
         self.dumping = False    # True if asciidoc -c option specified.
+        self.checking = False   # True if asciidoc --check option specified.
+        self.incremental = False    # True if --incremental option specified.
+        self.watching = False   # True if asciidoc --watch option specified.
         self.filters = []       # Filter names specified by --filter option.
 
     def init(self, cmd):
@@ -4599,12 +6807,15 @@ class Config:
             fname = os.path.join(dir, fname)
         # Sliently skip missing configuration file.
         if not os.path.isfile(fname):
+            # Creating it would change the output.
+            manifest.add_file(fname)
             return False
         # Don't load conf files twice (local and application conf files are the
         # same if the source file is in the application directory).
         if os.path.realpath(fname) in self.loaded:
             return True
         rdr = Reader()  # Reader processes system macros.
+        rdr.trusted = True
         message.linenos = False         # Disable document line numbers.
         rdr.open(fname)
         message.linenos = None
@@ -5882,6 +8093,14 @@ tables_OLD = Tables_OLD()   # Table_OLD definitions.
 tables = Tables()           # Table definitions.
 macros = Macros()           # Macro definitions.
 calloutmap = CalloutMap()   # Coordinates callouts and callout list.
+anchors = Anchors()         # Document element IDs registry.
+parsecache = ParseCache()   # Optional element parse cache.
+manifest = Manifest()       # Output document dependencies.
+watcher = Watcher()         # Implements --watch option.
+multibackend = MultiBackend() # Implements multiple -b option backends.
+parallel = Parallel()       # Implements --jobs option.
+profiler = Profiler()       # Implements --profile option.
+server = Server()           # Implements --serve option.
 trace = Trace()             # Implements trace attribute processing.
 
 ### Used by asciidocapi.py ###
@@ -5905,6 +8124,7 @@ def asciidoc(backend, doctype, confiles, infile, outfile, options):
                 else:
                     raise EAsciiDoc,'missing configuration file: %s' % f
     try:
+        sys_outputs.clear()
         document.attributes['python'] = sys.executable
         for f in config.filters:
             if not config.find_config_dir('filters', f):
@@ -5916,6 +8136,11 @@ def asciidoc(backend, doctype, confiles, infile, outfile, options):
             if o == '-c': config.dumping = True
             if o == '-s': config.header_footer = False
             if o == '-v': config.verbose = True
+            if o == '--check': config.checking = True
+            if o == '--incremental': config.incremental = True
+            if o == '--watch': config.watching = True
+        if config.checking:
+            config.cmd_attrs['xref-check'] = ''
         document.update_attributes()
         if '-e' not in options:
             # Load asciidoc.conf files in two passes: the first for attributes
@@ -5932,6 +8157,15 @@ def asciidoc(backend, doctype, confiles, infile, outfile, options):
         else:
             load_conffiles(include=['attributes','titles','specialchars'])
         document.update_attributes()
+        if config.watching:
+            # Returns in the conversion child process.
+            watcher.run(infile, confiles)
+        elif server.sock:
+            # Returns in the conversion child process.
+            infile,outfile = server.fork(infile, outfile, confiles)
+        if backend and ',' in backend:
+            # Returns in the conversion child processes.
+            backend = multibackend.run(backend.split(','), infile, outfile)
         # Check the infile exists.
         if infile != '<stdin>':
             if not os.path.isfile(infile):
@@ -5967,9 +8201,12 @@ def asciidoc(backend, doctype, confiles, infile, outfile, options):
                 config.load_filters([indir])
                 # Load document specific configuration files.
                 f = os.path.splitext(infile)[0]
-                doc_conffiles = [
-                        f for f in (f+'.conf', f+'-'+document.backend+'.conf')
-                        if os.path.isfile(f) ]
+                candidates = (f+'.conf', f+'-'+document.backend+'.conf')
+                doc_conffiles = [f for f in candidates if os.path.isfile(f)]
+                for f in candidates:
+                    # Missing files are recorded, creating one changes the
+                    # output.
+                    manifest.add_file(f)
                 for f in doc_conffiles:
                     config.load_file(f)
         load_conffiles()
@@ -5982,8 +8219,10 @@ def asciidoc(backend, doctype, confiles, infile, outfile, options):
         attrs = {}
         attrs.update(AttributeEntry.attributes)
         attrs.update(config.cmd_attrs)
-        if 'title' in attrs:    # Don't pass the header title.
-            del attrs['title']
+        # Don't pass the header title or whole document options.
+        for k in ('title','anchor-index','xref-check','parse-cache'):
+            if k in attrs:
+                del attrs[k]
         for k,v in attrs.items():
             if v:
                 args += ' --attribute "%s=%s"' % (k,v)
@@ -5997,6 +8236,7 @@ def asciidoc(backend, doctype, confiles, infile, outfile, options):
                 # Change file extension.
                 outfile = os.path.splitext(outfile)[0] + config.outfilesuffix
         document.outfile = outfile
+        watcher.outfile = outfile
         # Document header attributes override conf file attributes.
         document.attributes.update(AttributeEntry.attributes)
         document.update_attributes()
@@ -6017,19 +8257,51 @@ def asciidoc(backend, doctype, confiles, infile, outfile, options):
             config.dump()
         else:
             writer.newline = config.newline
+            incremental = (config.incremental and not config.checking
+                           and outfile != '<stdout>')
+            if incremental and manifest.is_current(outfile):
+                message.verbose('up to date: %s' % outfile, False)
+                reader.closefile()
+                return
+            if 'parse-cache' in document.attributes or multibackend.backends:
+                parsecache.begin(infile)
             try:
-                writer.open(outfile, reader.bom)
+                if config.checking:
+                    writer.open(None)   # Discard the output.
+                else:
+                    writer.open(outfile, reader.bom)
                 try:
                     document.translate(has_header) # Generate the output.
                 finally:
                     writer.close()
             finally:
                 reader.closefile()
+            if 'xref-check' in document.attributes:
+                anchors.check_xrefs()
+            if 'parse-cache' in document.attributes and not config.checking \
+                    and not document.has_errors:
+                parsecache.end(infile)
+            if incremental:
+                if document.has_errors:
+                    manifest.remove(outfile)
+                else:
+                    manifest.write(outfile)
+            index = document.attributes.get('anchor-index')
+            if index is not None:
+                if not index:
+                    if outfile == '<stdout>':
+                        raise EAsciiDoc,'anchor-index file name required'
+                    index = os.path.splitext(outfile)[0] + '-anchors.json'
+                anchors.write_index(index)
+        if profiler.fname:
+            profiler.report()
     except KeyboardInterrupt:
         raise
     except Exception,e:
         # Cleanup.
-        if outfile and outfile != '<stdout>' and os.path.isfile(outfile):
+        parallel.abort()
+        if (outfile and outfile != '<stdout>' and not config.checking
+                and os.path.isfile(outfile)):
             os.unlink(outfile)
         # Build and print error description.
         msg = 'FAILED: '
@@ -6139,6 +8411,19 @@ def execute(cmd,opts,args):
             backend = v
         if o in ('-c','--dump-conf'):
             options.append('-c')
+        if o == '--check':
+            options.append('--check')
+        if o == '--incremental':
+            options.append('--incremental')
+        if o == '--watch':
+            options.append('--watch')
+        if o == '--jobs':
+            if not re.match(r'^[1-9]\d*$', v):
+                usage('Illegal --jobs option: %s' % v)
+                sys.exit(1)
+            parallel.jobs = int(v)
+        if o == '--profile':
+            profiler.start(os.path.abspath(v))
         if o in ('-d','--doctype'):
             doctype = v
         if o in ('-e','--no-conf'):
@@ -6170,6 +8455,10 @@ def execute(cmd,opts,args):
             options.append('-s')
         if o in ('-v','--verbose'):
             options.append('-v')
+    # Options that change the output invalidate incremental builds.
+    manifest.args = [(o,v) for o,v in opts if o not in
+            ('-o','--out-file','-v','--verbose','--incremental','--check',
+             '--watch','--jobs','--profile')]
     if help_option:
         if len(args) == 0:
             show_help('default')
@@ -6209,17 +8498,20 @@ def execute(cmd,opts,args):
     finally:
         sys.stdin,sys.stdout = stdin,stdout
 
+# Command-line options in getopt.getopt() format.
+#DEPRECATED: --unsafe option.
+OPTIONS = 'a:b:cd:ef:hno:svw:'
+LONG_OPTIONS = ['attribute=','backend=','conf-file=','doctype=','dump-conf',
+    'help','no-conf','no-header-footer','out-file=',
+    'section-numbers','verbose','version','safe','unsafe',
+    'doctest','filter=','theme=','check','incremental','watch',
+    'serve=','workers=','jobs=','profile=']
+
 if __name__ == '__main__':
     # Process command line options.
     import getopt
     try:
-        #DEPRECATED: --unsafe option.
-        opts,args = getopt.getopt(sys.argv[1:],
-            'a:b:cd:ef:hno:svw:',
-            ['attribute=','backend=','conf-file=','doctype=','dump-conf',
-            'help','no-conf','no-header-footer','out-file=',
-            'section-numbers','verbose','version','safe','unsafe',
-            'doctest','filter=','theme='])
+        opts,args = getopt.getopt(sys.argv[1:], OPTIONS, LONG_OPTIONS)
     except getopt.GetoptError:
         message.stderr('illegal command options')
         sys.exit(1)
@@ -6234,6 +8526,15 @@ if __name__ == '__main__':
             sys.exit(0)
         else:
             sys.exit(1)
+    if '--serve' in opt_names:
+        # Run conversion server.
+        opts = dict(opts)
+        workers = opts.get('--workers')
+        if workers is not None:
+            if not re.match(r'^[1-9]\d*$', workers):
+                die('illegal --workers option: %s' % workers)
+            workers = int(workers)
+        server.serve(opts['--serve'], workers, '--unsafe' in opts)
     # Look for plugin management commands.
     count = 0
     for o,v in opts:
@@ -153,6 +153,7 @@ class AsciiDocAPI(object):
         self.options = Options()
         self.attributes = {}
         self.messages = []
+        self.trace = None
         # Search for the asciidoc command file.
         # Try ASCIIDOC_PY environment variable first.
         cmd = os.environ.get('ASCIIDOC_PY')
@@ -238,6 +239,8 @@ class AsciiDocAPI(object):
         # exit, there are globals and statics in asciidoc.py that have
         # to be reinitialized before each run -- hence the reload.
         self.__import_asciidoc(reload=True)
+        if self.trace is not None:
+            self.asciidoc.trace.callback = self.trace
         try:
             try:
                 self.asciidoc.execute(self.cmd, opts.values, args)
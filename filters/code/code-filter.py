@@ -11,6 +11,9 @@ DESCRIPTION
     This filter reads source code from the standard input, highlights language
     keywords and comments and writes to the standard output.
 
+    The filter can also be run in-process: asciidoc(1) calls the
+    asciidoc_filter() function and other programs can call code_filter().
+
     The purpose of this program is to demonstrate how to write an AsciiDoc
     filter -- it's much to simplistic to be passed off as a code syntax
     highlighter. Use the 'source-highlight-filter' instead.
@@ -52,7 +55,7 @@ COPYING
 
 import os, sys, re, string
 
-VERSION = '1.1.2'
+VERSION = '1.2.0'
 
 # Globals.
 language = None
@@ -116,64 +119,93 @@ inline_comments = {
 def print_stderr(line):
     sys.stderr.write(line+os.linesep)
 
-def sub_keyword(mo):
-    '''re.subs() argument to tag keywords.'''
-    word = mo.group('word')
-    if word in keywords[language]:
+class Highlighter:
+    """
+    Precompiled keyword and comment highlighter for a language and backend.
+    """
+    def __init__(self, language, backend):
+        words = [w for w in keywords[language] if re.match(r'^\w+$', w)]
+        # Longest first so alternation tries keywords before their prefixes.
+        words.sort(key=len, reverse=True)
         stag,etag = keywordtags[backend]
-        return stag+word+etag
-    else:
-        return word
-
-def code_filter():
-    '''This function does all the work.'''
-    global language, backend
-    inline_comment = inline_comments[language]
-    blk_comment = block_comments[language]
-    if blk_comment:
-        blk_comment = (re.escape(block_comments[language][0]),
-            re.escape(block_comments[language][1]))
-    stag,etag = commenttags[backend]
-    in_comment = 0  # True if we're inside a multi-line block comment.
-    tag_comment = 0 # True if we should tag the current line as a comment.
-    line = sys.stdin.readline()
-    while line:
-        line = string.rstrip(line)
-        line = string.expandtabs(line,tabsize)
-        # Escape special characters.
-        line = string.replace(line,'&','&amp;')
-        line = string.replace(line,'<','&lt;')
-        line = string.replace(line,'>','&gt;')
-        # Process block comment.
+        self.keyword_re = re.compile(r'\b(%s)\b' % '|'.join(words))
+        self.keyword_repl = '%s\\1%s' % (stag.replace('\\', r'\\'),
+                                          etag.replace('\\', r'\\'))
+        self.inline_comment = inline_comments[language]
+        blk_comment = block_comments[language]
         if blk_comment:
-            if in_comment:
-                if re.match(r'.*'+blk_comment[1]+r'$',line):
-                    in_comment = 0
-            else:
-                if re.match(r'^\s*'+blk_comment[0]+r'.*'+blk_comment[1],line):
-                    # Single line block comment.
-                    tag_comment = 1
-                elif re.match(r'^\s*'+blk_comment[0],line):
-                    # Start of multi-line block comment.
-                    tag_comment = 1
-                    in_comment = 1
-                else:
-                    tag_comment = 0
-        if tag_comment:
-            if line: line = stag+line+etag
+            start,end = [re.escape(s) for s in blk_comment]
+            self.comment_end_re = re.compile(r'.*'+end+r'$')
+            self.comment_line_re = re.compile(r'^\s*'+start+r'.*'+end)
+            self.comment_start_re = re.compile(r'^\s*'+start)
         else:
-            if inline_comment:
-                pos = string.find(line,inline_comment)
-            else:
-                pos = -1
-            if pos >= 0:
-                # Process inline comment.
-                line = re.sub(r'\b(?P<word>\w+)\b',sub_keyword,line[:pos]) \
-                    + stag + line[pos:] + etag
+            self.comment_start_re = None
+        self.commenttags = commenttags[backend]
+
+    def highlight(self, text, tabsize=8):
+        """Return list of highlighted lines from source code text."""
+        # Escape special characters.
+        text = text.expandtabs(tabsize)
+        text = text.replace('&','&amp;').replace('<','&lt;').replace('>','&gt;')
+        lines = text.split('\n')
+        if lines and not lines[-1]:
+            del lines[-1]
+        keyword_sub = self.keyword_re.sub
+        keyword_repl = self.keyword_repl
+        inline_comment = self.inline_comment
+        stag,etag = self.commenttags
+        in_comment = False  # True if we're inside a multi-line block comment.
+        tag_comment = False # True if we should tag the current line as a comment.
+        result = []
+        for line in lines:
+            line = line.rstrip()
+            # Process block comment.
+            if self.comment_start_re:
+                if in_comment:
+                    if self.comment_end_re.match(line):
+                        in_comment = False
+                else:
+                    if self.comment_line_re.match(line):
+                        # Single line block comment.
+                        tag_comment = True
+                    elif self.comment_start_re.match(line):
+                        # Start of multi-line block comment.
+                        tag_comment = True
+                        in_comment = True
+                    else:
+                        tag_comment = False
+            if tag_comment:
+                if line: line = stag+line+etag
             else:
-                line = re.sub(r'\b(?P<word>\w+)\b',sub_keyword,line)
-        sys.stdout.write(line + os.linesep)
-        line = sys.stdin.readline()
+                if inline_comment:
+                    pos = line.find(inline_comment)
+                else:
+                    pos = -1
+                if pos >= 0:
+                    # Process inline comment.
+                    line = keyword_sub(keyword_repl,line[:pos]) \
+                        + stag + line[pos:] + etag
+                else:
+                    line = keyword_sub(keyword_repl,line)
+            result.append(line)
+        return result
+
+# Compiled highlighters keyed by (language,backend).
+highlighters = {}
+
+def code_filter(text, language, backend, tabsize=8):
+    '''Return list of highlighted lines from source code text.'''
+    key = (language,backend)
+    if key not in highlighters:
+        highlighters[key] = Highlighter(language, backend)
+    return highlighters[key].highlight(text, tabsize)
+
+def asciidoc_filter(lines, args):
+    '''In-process asciidoc(1) filter entry point, args are the command-line
+    arguments. Returns the list of filtered lines, including the trailing
+    blank line left by the command's terminating newline.'''
+    language,backend,tabsize = parse_args(args)
+    return code_filter('\n'.join(lines), language, backend, tabsize) + ['']
 
 def usage(msg=''):
     if msg:
@@ -181,23 +213,17 @@ def usage(msg=''):
     print_stderr('Usage: code-filter -b backend -l language [ -t tabsize ]')
     print_stderr('                   [ --help | -h ] [ --version | -v ]')
 
-def main():
-    global language, backend, tabsize
-    # Process command line options.
+def parse_args(args):
+    '''Return (language,backend,tabsize) from command-line args list.
+    Raises ValueError if the arguments are invalid.'''
+    language = None
+    backend = None
+    tabsize = 8
     import getopt
-    opts,args = getopt.getopt(sys.argv[1:],
-        'b:l:ht:v',
-        ['help','version'])
+    opts,args = getopt.getopt(args, 'b:l:t:', [])
     if len(args) > 0:
-        usage()
-        sys.exit(1)
+        raise ValueError, 'unexpected arguments: %s' % ' '.join(args)
     for o,v in opts:
-        if o in ('--help','-h'):
-            print __doc__
-            sys.exit(0)
-        if o in ('--version','-v'):
-            print('code-filter version %s' % (VERSION,))
-            sys.exit(0)
         if o == '-b': backend = v
         if o == '-l':
             v = string.lower(v)
@@ -207,25 +233,44 @@ def main():
             try:
                 tabsize = int(v)
             except:
-                usage('illegal tabsize')
-                sys.exit(1)
+                raise ValueError, 'illegal tabsize'
             if tabsize <= 0:
-                usage('illegal tabsize')
-                sys.exit(1)
+                raise ValueError, 'illegal tabsize'
     if backend is None:
-        usage('backend option is mandatory')
-        sys.exit(1)
+        raise ValueError, 'backend option is mandatory'
     if not keywordtags.has_key(backend):
-        usage('illegal backend option')
-        sys.exit(1)
+        raise ValueError, 'illegal backend option'
     if language is None:
-        usage('language option is mandatory')
-        sys.exit(1)
+        raise ValueError, 'language option is mandatory'
     if not keywords.has_key(language):
-        usage('illegal language option')
+        raise ValueError, 'illegal language option'
+    return language,backend,tabsize
+
+def main():
+    global language, backend, tabsize
+    # Process command line options.
+    import getopt
+    opts,args = getopt.getopt(sys.argv[1:],
+        'b:l:ht:v',
+        ['help','version'])
+    if len(args) > 0:
+        usage()
+        sys.exit(1)
+    for o,v in opts:
+        if o in ('--help','-h'):
+            print __doc__
+            sys.exit(0)
+        if o in ('--version','-v'):
+            print('code-filter version %s' % (VERSION,))
+            sys.exit(0)
+    try:
+        language,backend,tabsize = parse_args(sys.argv[1:])
+    except ValueError, e:
+        usage(str(e))
         sys.exit(1)
     # Do the work.
-    code_filter()
+    for line in code_filter(sys.stdin.read(), language, backend, tabsize):
+        sys.stdout.write(line + os.linesep)
 
 if __name__ == "__main__":
     try:
@@ -1,32 +1,55 @@
 #!/usr/bin/env python
 
-import os, sys, subprocess
+# Suppress warning: "the md5 module is deprecated; use hashlib instead"
+import warnings
+warnings.simplefilter('ignore',DeprecationWarning)
+
+import os, sys, shutil, subprocess, tempfile, md5
 from optparse import *
 
 __AUTHOR__ = "Gouichi Iisaka <iisaka51@gmail.com>"
-__VERSION__ = '1.1.4'
+__VERSION__ = '1.2.0'
 
 class EApp(Exception):
     '''Application specific exception.'''
     pass
 
+def install_file(src, dst):
+    '''Copy file src to dst atomically (readers never see a partial file).'''
+    tmp = tempfile.mktemp(suffix='.tmp', dir=os.path.dirname(dst))
+    try:
+        shutil.copyfile(src, tmp)
+        if os.name == 'nt' and os.path.isfile(dst):
+            os.remove(dst)
+        os.rename(tmp, dst)
+    finally:
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+
 class Application():
     '''
 NAME
     graphviz2png - Converts textual graphviz notation to PNG file
 
 SYNOPSIS
-    graphviz2png [options] INFILE
+    graphviz2png [options] INFILE...
 
 DESCRIPTION
     This filter reads Graphviz notation text from the input file
     INFILE (or stdin if INFILE is -), converts it to a PNG image file.
 
+    If more than one INFILE is specified all the graphs are rendered by
+    a single Graphviz process; each output file is named like its INFILE
+    but with a .png file name extension. Batching only applies to
+    command-line use: the AsciiDoc graphviz filter runs graphviz2png once
+    per block so document images are not batched (use the
+    filter-cachedir attribute to share rendered images instead).
 
 OPTIONS
     -o OUTFILE, --outfile=OUTFILE
         The file name of the output file. If not specified the output file is
-        named like INFILE but with a .png file name extension.
+        named like INFILE but with a .png file name extension. Only
+        allowed with a single INFILE.
 
     -L LAYOUT, --layout=LAYOUT
         Graphviz layout: dot, neato, twopi, circo, fdp
@@ -37,6 +60,18 @@ OPTIONS
         supports. Run dot -T? to get the full list.
         Default is 'png'.
 
+    -c CACHEDIR, --cachedir=CACHEDIR
+        Share rendered images through the cache directory CACHEDIR.
+        Cached images are keyed by a checksum of the graph source, the
+        layout and the format so identical graphs are only rendered
+        once, even across documents. The directory is created if it
+        does not exist.
+
+    -m, --modified
+        Skip if the graph source, layout and format are unchanged since
+        OUTFILE was written. The checksum is stored in a file named like
+        OUTFILE but with a .md5 file name extension.
+
     -v, --verbose
         Verbosely print processing information to stderr.
 
@@ -72,7 +107,7 @@ LICENSE
         if not argv:
             argv = sys.argv
 
-        self.usage = '%prog [options] inputfile'
+        self.usage = '%prog [options] inputfile...'
         self.version = 'Version: %s\n' % __VERSION__
         self.version += 'Copyright(c) 2008-2009: %s\n' % __AUTHOR__
 
@@ -88,6 +123,12 @@ LICENSE
                 dest="format", default="png", type="choice",
                 choices=supported_formats,
                 help="Format type. FORMAT=<" + "|".join(supported_formats) + ">"),
+            Option("-c", "--cachedir", action="store",
+                dest="cachedir",
+                help="Shared image cache directory"),
+            Option("-m", "--modified", action="store_true",
+                dest="modified", default=False,
+                help="Skip if the graph is unchanged"),
             Option("--debug", action="store_true",
                 dest="do_debug",
                 help=SUPPRESS_HELP),
@@ -100,12 +141,20 @@ LICENSE
                                     option_list=self.option_list)
         (self.options, self.args) = self.parser.parse_args()
 
-        if len(self.args) != 1:
+        if len(self.args) < 1:
             self.parser.print_help()
             sys.exit(1)
+        if len(self.args) > 1 and (self.options.outfile is not None
+                                   or '-' in self.args):
+            sys.stderr.write('OUTFILE and - require a single INFILE' + os.linesep)
+            sys.exit(1)
 
         self.options.infile = self.args[0]
 
+    def verbose(self, msg):
+        if self.options.do_verbose:
+            sys.stderr.write(msg + os.linesep)
+
     def systemcmd(self, cmd):
         if self.options.do_verbose:
             msg = 'Execute: %s' % cmd
@@ -115,28 +164,90 @@ LICENSE
         if os.system(cmd):
             raise EApp, 'failed command: %s' % cmd
 
-    def graphviz2png(self, infile, outfile):
-        '''Convert Graphviz notation in file infile to
-           PNG file named outfile.'''
-
-        outfile = os.path.abspath(outfile)
-        outdir = os.path.dirname(outfile)
-
-        if not os.path.isdir(outdir):
-            raise EApp, 'directory does not exist: %s' % outdir
-
-        basefile = os.path.splitext(outfile)[0]
+    def checksum(self, infile):
+        '''Return hex checksum of the graph in infile, layout and format.'''
+        f = open(infile)
+        try:
+            source = f.read()
+        finally:
+            f.close()
+        return md5.new('%s\0%s\0%s' % (self.options.layout,
+                       self.options.format, source)).hexdigest()
+
+    def render(self, jobs):
+        '''Render the (infile,outfile) jobs with a single Graphviz run.'''
+        outdir = os.path.dirname(jobs[0][1])
+        tmpdir = tempfile.mkdtemp(dir=outdir)
         saved_cwd = os.getcwd()
         os.chdir(outdir)
         try:
-            cmd = '%s -T%s "%s" > "%s"' % (
-                  self.options.layout, self.options.format, infile, outfile)
+            # dot -O names the output for input file F like F.FORMAT.
+            infiles = []
+            for i,(infile,outfile) in enumerate(jobs):
+                f = os.path.join(tmpdir, 'g%d.gv' % i)
+                shutil.copyfile(infile, f)
+                infiles.append(f)
+            cmd = '%s -T%s -O %s' % (self.options.layout, self.options.format,
+                  ' '.join(['"%s"' % f for f in infiles]))
             self.systemcmd(cmd)
+            for f,(infile,outfile) in zip(infiles, jobs):
+                f += '.' + self.options.format
+                if not os.path.isfile(f):
+                    raise EApp, 'missing Graphviz output for: %s' % infile
+                install_file(f, outfile)
         finally:
             os.chdir(saved_cwd)
+            shutil.rmtree(tmpdir, True)
+
+    def graphviz2png_batch(self, jobs):
+        '''Convert Graphviz notation in (infile,outfile) jobs to image files.
+           Unchanged and cached graphs are skipped, the rest are rendered
+           by a single Graphviz run.'''
+        cachedir = self.options.cachedir
+        if cachedir and not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        pending = []
+        done = []
+        for infile,outfile in jobs:
+            outfile = os.path.abspath(outfile)
+            outdir = os.path.dirname(outfile)
+            if not os.path.isdir(outdir):
+                raise EApp, 'directory does not exist: %s' % outdir
+            if not os.path.isfile(infile):
+                raise EApp, 'input file does not exist: %s' % infile
+            key = self.checksum(infile)
+            md5_file = os.path.splitext(outfile)[0] + '.md5'
+            if self.options.modified and os.path.isfile(outfile) and \
+                    os.path.isfile(md5_file) and \
+                    open(md5_file).read() == key:
+                self.verbose('Skipped: no change: %s' % outfile)
+                continue
+            cached = None
+            if cachedir:
+                cached = os.path.join(cachedir, 'graphviz2png-%s.%s'
+                                      % (key, self.options.format))
+                if os.path.isfile(cached):
+                    self.verbose('Cached: %s' % cached)
+                    install_file(cached, outfile)
+                    cached = None
+                else:
+                    pending.append((infile, outfile))
+            else:
+                pending.append((infile, outfile))
+            done.append((outfile, cached, md5_file, key))
+        if pending:
+            self.render(pending)
+        for outfile, cached, md5_file, key in done:
+            if cached:
+                self.verbose('Caching: %s' % cached)
+                install_file(outfile, cached)
+            if self.options.modified:
+                open(md5_file, 'w').write(key)
 
-        if not self.options.do_debug:
-            os.unlink(infile)
+    def graphviz2png(self, infile, outfile):
+        '''Convert Graphviz notation in file infile to
+           PNG file named outfile.'''
+        self.graphviz2png_batch([(infile, outfile)])
 
     def run(self):
         if self.options.format == '':
@@ -144,25 +255,23 @@ LICENSE
 
         if self.options.infile == '-':
             if self.options.outfile is None:
-                sys.stderr.write('OUTFILE must be specified')
+                sys.stderr.write('OUTFILE must be specified' + os.linesep)
                 sys.exit(1)
             infile = os.path.splitext(self.options.outfile)[0] + '.txt'
             lines = sys.stdin.readlines()
             open(infile, 'w').writelines(lines)
-
-        if not os.path.isfile(infile):
-            raise EApp, 'input file does not exist: %s' % infile
-
-        if self.options.outfile is None:
-            outfile = os.path.splitext(infile)[0] + '.png'
-        else:
-            outfile = self.options.outfile
-
-        self.graphviz2png(infile, outfile)
-
-        # To suppress asciidoc 'no output from filter' warnings.
-        if self.options.infile == '-':
+            try:
+                self.graphviz2png(infile, self.options.outfile)
+            finally:
+                if not self.options.do_debug:
+                    os.unlink(infile)
+            # To suppress asciidoc 'no output from filter' warnings.
             sys.stdout.write(' ')
+        elif self.options.outfile is not None:
+            self.graphviz2png(self.options.infile, self.options.outfile)
+        else:
+            self.graphviz2png_batch([(infile, os.path.splitext(infile)[0] + '.png')
+                                     for infile in self.args])
 
 if __name__ == "__main__":
     app = Application()
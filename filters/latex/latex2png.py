@@ -4,13 +4,20 @@ NAME
     latex2png - Converts LaTeX source to PNG file
 
 SYNOPSIS
-    latex2png [options] INFILE
+    latex2png [options] INFILE...
 
 DESCRIPTION
     This filter reads LaTeX source text from the input file
     INFILE (or stdin if INFILE is -) and renders it to PNG image file.
     Typically used to render math equations.
 
+    If more than one INFILE is specified they are rendered as a batch:
+    each source becomes a page of a single LaTeX document which is
+    compiled once and split into PNG files with a single dvipng(1) run.
+    Batching only applies to command-line use: the AsciiDoc latex filter
+    runs latex2png once per block so document images are not batched
+    (use the filter-cachedir attribute to share rendered images instead).
+
     Requires latex(1), dvipng(1) commands and LaTeX math packages.
 
 OPTIONS
@@ -18,9 +25,17 @@ OPTIONS
         Set the output resolution to DPI dots per inch. Use this option to
         scale the output image size.
 
+    -c CACHEDIR
+        Share rendered images through the cache directory CACHEDIR.
+        Cached images are keyed by a checksum of the LaTeX preamble, the
+        source text and the DPI so identical sources are only rendered
+        once, even across documents. The directory is created if it
+        does not exist.
+
     -o OUTFILE
         The file name of the output file. If not specified the output file is
-        named like INFILE but with a .png file name extension.
+        named like INFILE but with a .png file name extension. Only
+        allowed with a single INFILE.
 
     -m
         Skip if the PNG output file is newer that than the INFILE.
@@ -60,9 +75,9 @@ COPYING
 import warnings
 warnings.simplefilter('ignore',DeprecationWarning)
 
-import os, sys, tempfile, md5
+import os, sys, tempfile, shutil, md5
 
-VERSION = '0.1.0'
+VERSION = '0.2.0'
 
 # Include LaTeX packages and commands here.
 TEX_HEADER = r'''\documentclass{article}
@@ -114,36 +129,36 @@ def run(cmd):
     if os.system(cmd):
         raise EApp, 'failed command: %s' % cmd
 
-def latex2png(infile, outfile, dpi, modified):
-    '''Convert LaTeX input file infile to PNG file named outfile.'''
-    outfile = os.path.abspath(outfile)
-    outdir = os.path.dirname(outfile)
-    if not os.path.isdir(outdir):
-        raise EApp, 'directory does not exist: %s' % outdir
-    texfile = tempfile.mktemp(suffix='.tex', dir=os.path.dirname(outfile))
+def install_file(src, dst):
+    '''Copy file src to dst atomically (readers never see a partial file).'''
+    tmp = tempfile.mktemp(suffix='.tmp', dir=os.path.dirname(dst))
+    try:
+        shutil.copyfile(src, tmp)
+        if os.name == 'nt' and os.path.isfile(dst):
+            os.remove(dst)
+        os.rename(tmp, dst)
+    finally:
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+
+def cache_file(cachedir, tex, dpi):
+    '''Return the name of the cached image for LaTeX source tex.'''
+    key = md5.new('%s\0%s\0%s' % (TEX_HEADER, tex, dpi or '')).hexdigest()
+    return os.path.join(cachedir, 'latex2png-%s.png' % key)
+
+def render(sources, outfiles, dpi):
+    '''Render each LaTeX source in the sources list as a page of a single
+    LaTeX document and write page images to the corresponding outfiles.'''
+    outdir = os.path.dirname(outfiles[0])
+    texfile = tempfile.mktemp(suffix='.tex', dir=outdir)
     basefile = os.path.splitext(texfile)[0]
     dvifile = basefile + '.dvi'
+    pngfile = basefile + '-%d.png'
+    pngs = [pngfile % (i+1) for i in range(len(sources))]
     temps = [basefile + ext for ext in ('.tex','.dvi', '.aux', '.log')]
-    skip = False
-    if infile == '-':
-        tex = sys.stdin.read()
-        if modified:
-            checksum = md5.new(tex).digest()
-            md5_file = os.path.splitext(outfile)[0] + '.md5'
-            if os.path.isfile(md5_file) and os.path.isfile(outfile) and \
-                    checksum == read_file(md5_file,'rb'):
-                skip = True
-    else:
-        if not os.path.isfile(infile):
-            raise EApp, 'input file does not exist: %s' % infile
-        tex = read_file(infile)
-        if modified and os.path.isfile(outfile) and \
-                os.path.getmtime(infile) <= os.path.getmtime(outfile):
-            skip = True
-    if skip:
-        print_verbose('skipped: no change: %s' % outfile)
-        return
-    tex = '%s\n%s\n%s\n' % (TEX_HEADER, tex.strip(), TEX_FOOTER)
+    temps += pngs
+    tex = '%s\n%s\n%s\n' % (TEX_HEADER, '\n\\clearpage\n'.join(sources),
+            TEX_FOOTER)
     print_verbose('tex:\n%s' % tex)
     write_file(texfile, tex)
     saved_pwd = os.getcwd()
@@ -151,31 +166,96 @@ def latex2png(infile, outfile, dpi, modified):
     try:
         # Compile LaTeX document to DVI file.
         run('latex %s' % texfile)
-        # Convert DVI file to PNG.
+        # Convert DVI file pages to PNG files.
         cmd = 'dvipng'
         if dpi:
             cmd += ' -D %s' % dpi
         cmd += ' -T tight -x 1000 -z 9 -bg Transparent --truecolor -o "%s" "%s" ' \
-               % (outfile,dvifile)
+               % (pngfile,dvifile)
         run(cmd)
+        for png in pngs:
+            if not os.path.isfile(png):
+                raise EApp, 'expected %d pages, missing: %s' % (len(pngs), png)
+        if os.path.isfile(pngfile % (len(pngs)+1)):
+            raise EApp, 'expected %d pages, got more' % len(pngs)
+        for png,outfile in zip(pngs,outfiles):
+            print_verbose('writing: %s' % outfile)
+            install_file(png, outfile)
     finally:
         os.chdir(saved_pwd)
         for f in temps:
             if os.path.isfile(f):
                 print_verbose('deleting: %s' % f)
                 os.remove(f)
-    if 'md5_file' in locals():
-        print_verbose('writing: %s' % md5_file)
-        write_file(md5_file, checksum, 'wb')
+
+def latex2png_batch(jobs, dpi, modified, cachedir=None):
+    '''Convert LaTeX input files to PNG files. jobs is a list of
+    (infile,outfile) tuples; all sources that are not skipped or found in
+    the cachedir are rendered by a single latex(1) and dvipng(1) run.'''
+    if cachedir and not os.path.isdir(cachedir):
+        os.makedirs(cachedir)
+    pending = []
+    for infile,outfile in jobs:
+        outfile = os.path.abspath(outfile)
+        outdir = os.path.dirname(outfile)
+        if not os.path.isdir(outdir):
+            raise EApp, 'directory does not exist: %s' % outdir
+        skip = False
+        md5_file = checksum = None
+        if infile == '-':
+            tex = sys.stdin.read()
+            if modified:
+                checksum = md5.new(tex).digest()
+                md5_file = os.path.splitext(outfile)[0] + '.md5'
+                if os.path.isfile(md5_file) and os.path.isfile(outfile) and \
+                        checksum == read_file(md5_file,'rb'):
+                    skip = True
+        else:
+            if not os.path.isfile(infile):
+                raise EApp, 'input file does not exist: %s' % infile
+            tex = read_file(infile)
+            if modified and os.path.isfile(outfile) and \
+                    os.path.getmtime(infile) <= os.path.getmtime(outfile):
+                skip = True
+        if skip:
+            print_verbose('skipped: no change: %s' % outfile)
+            continue
+        tex = tex.strip()
+        cached = None
+        if cachedir:
+            cached = cache_file(cachedir, tex, dpi)
+            if os.path.isfile(cached):
+                print_verbose('cached: %s' % cached)
+                install_file(cached, outfile)
+                if md5_file:
+                    print_verbose('writing: %s' % md5_file)
+                    write_file(md5_file, checksum, 'wb')
+                continue
+        pending.append((tex, outfile, cached, md5_file, checksum))
+    if not pending:
+        return
+    render([job[0] for job in pending], [job[1] for job in pending], dpi)
+    for tex, outfile, cached, md5_file, checksum in pending:
+        if cached:
+            print_verbose('caching: %s' % cached)
+            install_file(outfile, cached)
+        if md5_file:
+            print_verbose('writing: %s' % md5_file)
+            write_file(md5_file, checksum, 'wb')
+
+def latex2png(infile, outfile, dpi, modified, cachedir=None):
+    '''Convert LaTeX input file infile to PNG file named outfile.'''
+    latex2png_batch([(infile, outfile)], dpi, modified, cachedir)
 
 def usage(msg=''):
     if msg:
         print_stderr(msg)
     print_stderr('\n'
                  'usage:\n'
-                 '    latex2png [options] INFILE\n'
+                 '    latex2png [options] INFILE...\n'
                  '\n'
                  'options:\n'
+                 '    -c CACHEDIR\n'
                  '    -D DPI\n'
                  '    -o OUTFILE\n'
                  '    -m\n'
@@ -189,8 +269,9 @@ def main():
     dpi = None
     outfile = None
     modified = False
+    cachedir = None
     import getopt
-    opts,args = getopt.getopt(sys.argv[1:], 'D:o:mhv', ['help','version'])
+    opts,args = getopt.getopt(sys.argv[1:], 'c:D:o:mhv', ['help','version'])
     for o,v in opts:
         if o in ('--help','-h'):
             print __doc__
@@ -198,26 +279,35 @@ def main():
         if o =='--version':
             print('latex2png version %s' % (VERSION,))
             sys.exit(0)
+        if o == '-c': cachedir = v
         if o == '-D': dpi = v
         if o == '-o': outfile = v
         if o == '-m': modified = True
         if o == '-v': verbose = True
-    if len(args) != 1:
+    if len(args) < 1:
         usage()
         sys.exit(1)
-    infile = args[0]
     if dpi and not dpi.isdigit():
         usage('invalid DPI')
         sys.exit(1)
+    if len(args) > 1:
+        if outfile is not None:
+            usage('OUTFILE cannot be specified with multiple INFILEs')
+            sys.exit(1)
+        if '-' in args:
+            usage('INFILE cannot be - with multiple INFILEs')
+            sys.exit(1)
     if outfile is None:
-        if infile == '-':
+        if args[0] == '-':
             usage('OUTFILE must be specified')
             sys.exit(1)
-        outfile = os.path.splitext(infile)[0] + '.png'
+        jobs = [(infile, os.path.splitext(infile)[0] + '.png') for infile in args]
+    else:
+        jobs = [(args[0], outfile)]
     # Do the work.
-    latex2png(infile, outfile, dpi, modified)
+    latex2png_batch(jobs, dpi, modified, cachedir)
     # Print something to suppress asciidoc 'no output from filter' warnings.
-    if infile == '-':
+    if args[0] == '-':
         sys.stdout.write(' ')
 
 if __name__ == "__main__":
@@ -4,13 +4,20 @@ NAME
     music2png - Converts textual music notation to classically notated PNG file
 
 SYNOPSIS
-    music2png [options] INFILE
+    music2png [options] INFILE...
 
 DESCRIPTION
     This filter reads LilyPond or ABC music notation text from the input file
     INFILE (or stdin if INFILE is -), converts it to classical music notation
     and writes it to a trimmed PNG image file.
 
+    If more than one INFILE is specified each is written to a PNG file
+    named like INFILE but with a .png file name extension; up to JOBS
+    files are rendered in parallel (see the -j option). Parallel
+    rendering only applies to command-line use: the AsciiDoc music filter
+    runs music2png once per block so document images are rendered one at
+    a time (use the filter-cachedir attribute to share rendered images).
+
     This script is a wrapper for LilyPond and ImageMagick commands.
 
 OPTIONS
@@ -18,9 +25,20 @@ OPTIONS
         The INFILE music format. 'abc' for ABC notation, 'ly' for LilyPond
         notation. Defaults to 'abc' unless source starts with backslash.
 
+    -c CACHEDIR
+        Share rendered images through the cache directory CACHEDIR.
+        Cached images are keyed by a checksum of the music format and
+        source so identical music is only rendered once, even across
+        documents. The directory is created if it does not exist.
+
+    -j JOBS
+        Render up to JOBS INFILEs in parallel. Defaults to 1. Ignored
+        (INFILEs are rendered serially) if Python is older than 2.6.
+
     -o OUTFILE
         The file name of the output file. If not specified the output file is
-        named like INFILE but with a .png file name extension.
+        named like INFILE but with a .png file name extension. Only
+        allowed with a single INFILE.
 
     -m
         Skip if the PNG output file is newer that than the INFILE.
@@ -54,9 +72,9 @@ COPYING
 import warnings
 warnings.simplefilter('ignore',DeprecationWarning)
 
-import os, sys, tempfile, md5
+import os, sys, tempfile, shutil, subprocess, md5
 
-VERSION = '0.1.2'
+VERSION = '0.2.0'
 
 # Globals.
 verbose = False
@@ -84,80 +102,138 @@ def read_file(filename, mode='r'):
     finally:
         f.close()
 
-def run(cmd):
+def run(cmd, cwd=None):
     global verbose
     if not verbose:
         cmd += ' 2>%s' % os.devnull
     print_verbose('executing: %s' % cmd)
-    if os.system(cmd):
+    if subprocess.call(cmd, shell=True, cwd=cwd):
         raise EApp, 'failed command: %s' % cmd
 
-def music2png(format, infile, outfile, modified):
-    '''Convert ABC notation in file infile to cropped PNG file named outfile.'''
-    outfile = os.path.abspath(outfile)
-    outdir = os.path.dirname(outfile)
-    if not os.path.isdir(outdir):
-        raise EApp, 'directory does not exist: %s' % outdir
-    basefile = tempfile.mktemp(dir=os.path.dirname(outfile))
-    temps = [basefile + ext for ext in ('.abc', '.ly', '.ps', '.midi')]
-    skip = False
-    if infile == '-':
-        source = sys.stdin.read()
-        checksum = md5.new(source).digest()
-        filename = os.path.splitext(outfile)[0] + '.md5'
-        if modified:
-            if os.path.isfile(filename) and os.path.isfile(outfile) and \
-                    checksum == read_file(filename,'rb'):
-                skip = True
-            else:
-                write_file(filename, checksum, 'wb')
-    else:
-        if not os.path.isfile(infile):
-            raise EApp, 'input file does not exist: %s' % infile
-        if modified and os.path.isfile(outfile) and \
-                os.path.getmtime(infile) <= os.path.getmtime(outfile):
-            skip = True
-        source = read_file(infile)
-    if skip:
-        print_verbose('skipped: no change: %s' % outfile)
-        return
+def install_file(src, dst):
+    '''Copy file src to dst atomically (readers never see a partial file).'''
+    tmp = tempfile.mktemp(suffix='.tmp', dir=os.path.dirname(dst))
+    try:
+        shutil.copyfile(src, tmp)
+        if os.name == 'nt' and os.path.isfile(dst):
+            os.remove(dst)
+        os.rename(tmp, dst)
+    finally:
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+
+def render(format, source, outfile, cachedir=None):
+    '''Render music source to cropped PNG file named outfile.'''
     if format is None:
         if source and source.startswith('\\'):  # Guess input format.
             format = 'ly'
         else:
             format = 'abc'
-    # Write temporary source file.
-    write_file('%s.%s' % (basefile,format), source)
+    cached = None
+    if cachedir:
+        key = md5.new('%s\0%s' % (format, source)).hexdigest()
+        cached = os.path.join(cachedir, 'music2png-%s.png' % key)
+        if os.path.isfile(cached):
+            print_verbose('cached: %s' % cached)
+            install_file(cached, outfile)
+            return
+    outdir = os.path.dirname(outfile)
+    basefile = tempfile.mktemp(dir=outdir)
+    temps = [basefile + ext for ext in ('.abc', '.ly', '.ps', '.midi', '.png')]
     abc = basefile + '.abc'
     ly = basefile + '.ly'
     png = basefile + '.png'
-    saved_pwd = os.getcwd()
-    os.chdir(outdir)
     try:
+        # Write temporary source file.
+        write_file('%s.%s' % (basefile,format), source)
         if format == 'abc':
-            run('abc2ly -o "%s" "%s"' % (ly,abc))
-        run('lilypond --png -o "%s" "%s"' % (basefile,ly))
-        os.rename(png, outfile)
+            run('abc2ly -o "%s" "%s"' % (ly,abc), outdir)
+        run('lilypond --png -o "%s" "%s"' % (basefile,ly), outdir)
+        # Chop the bottom 75 pixels off to get rid of the page footer then
+        # crop the music image. The -strip option necessary because FOP does
+        # not like the custom PNG color profile used by Lilypond.
+        run('convert "%s" -strip -gravity South -chop 0x75 -trim "%s"'
+            % (png, png))
+        install_file(png, outfile)
+        if cached:
+            print_verbose('caching: %s' % cached)
+            install_file(png, cached)
     finally:
-        os.chdir(saved_pwd)
-    # Chop the bottom 75 pixels off to get rid of the page footer then crop the
-    # music image. The -strip option necessary because FOP does not like the
-    # custom PNG color profile used by Lilypond.
-    run('convert "%s" -strip -gravity South -chop 0x75 -trim "%s"' % (outfile, outfile))
-    for f in temps:
-        if os.path.isfile(f):
-            print_verbose('deleting: %s' % f)
-            os.remove(f)
+        for f in temps:
+            if os.path.isfile(f):
+                print_verbose('deleting: %s' % f)
+                os.remove(f)
+
+def music2png_batch(format, jobs, modified, cachedir=None, processes=1):
+    '''Convert music notation in (infile,outfile) jobs to cropped PNG files.
+    Up to processes jobs are rendered concurrently.'''
+    if cachedir and not os.path.isdir(cachedir):
+        os.makedirs(cachedir)
+    pending = []
+    for infile,outfile in jobs:
+        outfile = os.path.abspath(outfile)
+        outdir = os.path.dirname(outfile)
+        if not os.path.isdir(outdir):
+            raise EApp, 'directory does not exist: %s' % outdir
+        skip = False
+        md5_file = checksum = None
+        if infile == '-':
+            source = sys.stdin.read()
+            if modified:
+                checksum = md5.new(source).digest()
+                md5_file = os.path.splitext(outfile)[0] + '.md5'
+                if os.path.isfile(md5_file) and os.path.isfile(outfile) and \
+                        checksum == read_file(md5_file,'rb'):
+                    skip = True
+        else:
+            if not os.path.isfile(infile):
+                raise EApp, 'input file does not exist: %s' % infile
+            if modified and os.path.isfile(outfile) and \
+                    os.path.getmtime(infile) <= os.path.getmtime(outfile):
+                skip = True
+            source = read_file(infile)
+        if skip:
+            print_verbose('skipped: no change: %s' % outfile)
+            continue
+        pending.append((source, outfile, md5_file, checksum))
+    def work(job):
+        source, outfile, md5_file, checksum = job
+        render(format, source, outfile, cachedir)
+        if md5_file:
+            write_file(md5_file, checksum, 'wb')
+    if processes > 1 and len(pending) > 1:
+        try:
+            # The work is done by child processes so threads are sufficient.
+            from multiprocessing.pool import ThreadPool
+        except ImportError: # Python 2.4 and 2.5.
+            print_verbose('rendering serially: multiprocessing not available')
+            processes = 1
+    if processes > 1 and len(pending) > 1:
+        pool = ThreadPool(min(processes, len(pending)))
+        try:
+            pool.map(work, pending)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in pending:
+            work(job)
+
+def music2png(format, infile, outfile, modified, cachedir=None):
+    '''Convert ABC notation in file infile to cropped PNG file named outfile.'''
+    music2png_batch(format, [(infile, outfile)], modified, cachedir)
 
 def usage(msg=''):
     if msg:
         print_stderr(msg)
     print_stderr('\n'
                  'usage:\n'
-                 '    music2png [options] INFILE\n'
+                 '    music2png [options] INFILE...\n'
                  '\n'
                  'options:\n'
+                 '    -c CACHEDIR\n'
                  '    -f FORMAT\n'
+                 '    -j JOBS\n'
                  '    -o OUTFILE\n'
                  '    -m\n'
                  '    -v\n'
@@ -170,8 +246,10 @@ def main():
     format = None
     outfile = None
     modified = False
+    cachedir = None
+    processes = 1
     import getopt
-    opts,args = getopt.getopt(sys.argv[1:], 'f:o:mhv', ['help','version'])
+    opts,args = getopt.getopt(sys.argv[1:], 'c:f:j:o:mhv', ['help','version'])
     for o,v in opts:
         if o in ('--help','-h'):
             print __doc__
@@ -179,26 +257,40 @@ def main():
         if o =='--version':
             print('music2png version %s' % (VERSION,))
             sys.exit(0)
+        if o == '-c': cachedir = v
         if o == '-f': format = v
+        if o == '-j':
+            if not v.isdigit() or int(v) < 1:
+                usage('invalid JOBS')
+                sys.exit(1)
+            processes = int(v)
         if o == '-o': outfile = v
         if o == '-m': modified = True
         if o == '-v': verbose = True
-    if len(args) != 1:
+    if len(args) < 1:
         usage()
         sys.exit(1)
-    infile = args[0]
     if format not in (None, 'abc', 'ly'):
         usage('invalid FORMAT')
         sys.exit(1)
+    if len(args) > 1:
+        if outfile is not None:
+            usage('OUTFILE cannot be specified with multiple INFILEs')
+            sys.exit(1)
+        if '-' in args:
+            usage('INFILE cannot be - with multiple INFILEs')
+            sys.exit(1)
     if outfile is None:
-        if infile == '-':
+        if args[0] == '-':
             usage('OUTFILE must be specified')
             sys.exit(1)
-        outfile = os.path.splitext(infile)[0] + '.png'
+        jobs = [(infile, os.path.splitext(infile)[0] + '.png') for infile in args]
+    else:
+        jobs = [(args[0], outfile)]
     # Do the work.
-    music2png(format, infile, outfile, modified)
+    music2png_batch(format, jobs, modified, cachedir, processes)
     # Print something to suppress asciidoc 'no output from filter' warnings.
-    if infile == '-':
+    if args[0] == '-':
         sys.stdout.write(' ')
 
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+'''
+NAME
+    pygments-filter - AsciiDoc filter to highlight source code with Pygments
+
+SYNOPSIS
+    pygments-filter -l LEXER [ -f FORMATTER ] [ -O OPTIONS ] [ -P OPTION ]
+                    [ --help | -h ] [ --version | -v ]
+
+DESCRIPTION
+    This filter reads source code from the standard input, highlights it
+    with Pygments and writes the result to the standard output. The
+    options and the output are the same as the pygmentize(1) command.
+
+    When run by asciidoc(1) the filter is loaded once and run in-process:
+    Pygments is imported once and lexer and formatter instances are
+    cached and reused for all the source blocks in the document.
+
+    If the Pygments Python package is not installed, or an option is not
+    supported by the filter, the pygmentize(1) command is run instead.
+
+OPTIONS
+    -l LEXER
+        The Pygments lexer (source language) name.
+
+    -f FORMATTER
+        The Pygments formatter name. Defaults to 'html'.
+
+    -O OPTIONS
+        Comma separated list of key=value lexer and formatter options.
+
+    -P OPTION
+        A single key=value lexer and formatter option.
+
+    --help, -h
+        Print this documentation.
+
+    --version, -v
+        Print program version number.
+
+SEE ALSO
+    pygmentize(1)
+
+COPYING
+    Free use of this software is granted under the terms of the GNU General
+    Public License (GPL).
+'''
+
+import os, sys, locale, subprocess
+
+try:
+    import pygments
+    from pygments.lexers import get_lexer_by_name
+    from pygments.formatters import get_formatter_by_name
+    from pygments.util import guess_decode, ClassNotFound, OptionError
+except ImportError:
+    pygments = None
+
+# Highlighting errors reported by asciidoc_filter().
+if pygments:
+    FILTER_ERRORS = (ClassNotFound, OptionError, LookupError, UnicodeError,
+                     OSError)
+else:
+    FILTER_ERRORS = (OSError,)
+
+VERSION = '1.0.0'
+
+# Lexer and formatter instances keyed by (name,options).
+lexers = {}
+formatters = {}
+
+class EUnsupported(Exception): pass # Options pygmentize(1) must handle.
+
+def print_stderr(line):
+    sys.stderr.write(line+os.linesep)
+
+def parse_args(args):
+    '''Return (lexer,formatter,options) from pygmentize(1) style args list.
+    Raises EUnsupported if the args can't be handled by the filter.'''
+    import getopt
+    try:
+        opts,args = getopt.getopt(args, 'l:f:O:P:')
+    except getopt.GetoptError, e:
+        raise EUnsupported, str(e)
+    if args:
+        raise EUnsupported, 'unexpected arguments: %s' % ' '.join(args)
+    lexer = None
+    formatter = 'html'
+    options = {}
+    for o,v in opts:
+        if o == '-l': lexer = v
+        if o == '-f': formatter = v
+        if o == '-O':
+            # Same parsing as pygmentize(1).
+            for arg in v.split(','):
+                arg = arg.strip()
+                if not arg:
+                    continue
+                if '=' in arg:
+                    key,value = arg.split('=', 1)
+                    options[key.strip()] = value.strip()
+                else:
+                    options[arg] = True
+        if o == '-P':
+            if '=' not in v:
+                raise EUnsupported, 'illegal -P option: %s' % v
+            key,value = v.split('=', 1)
+            options[key] = value
+    if lexer is None:
+        raise EUnsupported, 'lexer option is mandatory'
+    return lexer,formatter,options
+
+def get_lexer(name, options):
+    key = (name, tuple(sorted(options.items())))
+    if key not in lexers:
+        lexers[key] = get_lexer_by_name(name, **options)
+    return lexers[key]
+
+def get_formatter(name, options):
+    key = (name, tuple(sorted(options.items())))
+    if key not in formatters:
+        formatters[key] = get_formatter_by_name(name, **options)
+    return formatters[key]
+
+def highlight(code, lexer, formatter, options):
+    '''Return code (a byte string) highlighted by Pygments.'''
+    options = options.copy()
+    inencoding = options.get('inencoding', options.get('encoding'))
+    outencoding = options.get('outencoding', options.get('encoding'))
+    if inencoding:
+        code = code.decode(inencoding)
+    else:
+        # Decode like pygmentize(1) reading a pipe.
+        code = guess_decode(code)[0]
+    if not outencoding:
+        # pygmentize(1) writing to a pipe uses the preferred encoding.
+        options['outencoding'] = locale.getpreferredencoding()
+    lexer = get_lexer(lexer, options)
+    formatter = get_formatter(formatter, options)
+    return pygments.highlight(code, lexer, formatter)
+
+def pygmentize(code, args):
+    '''Highlight code with the pygmentize(1) command.'''
+    p = subprocess.Popen(['pygmentize'] + args,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output = p.communicate(code)[0]
+    if p.wait():
+        raise OSError, 'pygmentize returned %d' % p.returncode
+    return output
+
+def pygments_filter(code, args):
+    '''Return code highlighted according to the args list, in-process if
+    possible.'''
+    if pygments:
+        try:
+            lexer,formatter,options = parse_args(args)
+        except EUnsupported:
+            pass
+        else:
+            return highlight(code, lexer, formatter, options)
+    return pygmentize(code, args)
+
+def asciidoc_filter(lines, args):
+    '''In-process asciidoc(1) filter entry point, args are the command-line
+    arguments. Returns the list of filtered lines. Highlighting errors
+    (unknown lexer, pygmentize(1) failure) are written to stderr and no
+    lines are returned, like the filter command exiting non-zero.'''
+    try:
+        output = pygments_filter(os.linesep.join(lines), args)
+    except FILTER_ERRORS, e:
+        print_stderr('pygments-filter.py: %s' % e)
+        return []
+    if output:
+        return [s.rstrip() for s in output.split(os.linesep)]
+    else:
+        return []
+
+def usage(msg=''):
+    if msg:
+        print_stderr(msg)
+    print_stderr('Usage: pygments-filter -l LEXER [ -f FORMATTER ] [ -O OPTIONS ] [ -P OPTION ]')
+    print_stderr('                       [ --help | -h ] [ --version | -v ]')
+
+def main():
+    args = sys.argv[1:]
+    if '--help' in args or '-h' in args:
+        print __doc__
+        sys.exit(0)
+    if '--version' in args or '-v' in args:
+        print('pygments-filter version %s' % (VERSION,))
+        sys.exit(0)
+    sys.stdout.write(pygments_filter(sys.stdin.read(), args))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except SystemExit:
+        raise
+    except KeyboardInterrupt:
+        sys.exit(1)
+    except Exception, e:
+        print_stderr("%s: %s" % (os.path.basename(sys.argv[0]), str(e)))
+        sys.exit(1)
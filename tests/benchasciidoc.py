@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+
+USAGE = '''Usage: benchasciidoc.py [OPTIONS] COMMAND
+
+Benchmark AsciiDoc conversions of generated synthetic documents.
+
+Commands:
+  generate DIR                  Write the benchmark documents to DIR
+  run [DOCUMENT] [BACKEND]      Time conversions and compare to baseline
+  update [DOCUMENT] [BACKEND]   Time conversions and update the baseline
+
+Options:
+  -b, --baseline=BASELINE_FILE
+        Use baseline file BASELINE_FILE (default baseline file is
+        benchasciidoc.json in benchasciidoc.py directory)
+  -d, --dir=DIR
+        Generate the benchmark documents in DIR (default is a temporary
+        directory which is deleted when the benchmark is finished)
+  -m, --mix=FEATURES
+        Comma separated list of the document features mixed into the
+        'mixed' document (default is all features)
+  -r, --runs=RUNS
+        Time each conversion RUNS times (default 3)
+  -s, --size=LINES
+        Generate documents of approximately LINES lines (default 5000)
+  -t, --tolerance=PERCENT
+        Report throughput and memory differences greater than PERCENT
+        percent of the baseline as regressions (default 10)
+
+Documents:
+  prose, inline, lists, tables, includes, sections, filters, mixed'''
+
+
+__version__ = '0.1.0'
+
+
+import os, sys, time, random, shutil, subprocess, tempfile
+
+
+BACKENDS = ('html4','xhtml11','docbook','html5')    # Default backends.
+BACKEND_EXT = {'html4':'.html', 'xhtml11':'.html', 'docbook':'.xml',
+        'slidy':'.html','html5':'.html'}
+FEATURES = ('prose','inline','lists','tables','includes','sections',
+        'filters')
+DOCUMENTS = FEATURES + ('mixed',)
+
+WORDS = '''asciidoc text document markup section paragraph list table block
+macro attribute filter backend output source title header footer index
+reader writer element format style quote listing literal example sidebar
+admonition callout anchor reference image include conditional template
+configuration substitution replacement character special inline delimited
+author revision number level caption column row cell span width height
+'''.split()
+
+STUB_FILTER = '''\
+import sys
+sys.stdout.write(sys.stdin.read())
+'''
+
+STUB_FILTER_CONF = '''\
+[blockdef-listing]
+stub-style=template="listingblock",filter='"{python}" "{indir}/stubfilter.py"'
+'''
+
+
+def message(msg=''):
+    print >>sys.stderr, msg
+
+def asciidoc_py():
+    """
+    Return the asciidoc.py file name (the ASCIIDOC_PY environment variable
+    or the asciidoc.py in the parent directory).
+    """
+    result = os.environ.get('ASCIIDOC_PY')
+    if not result:
+        result = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                '..', 'asciidoc.py')
+    return os.path.normpath(result)
+
+
+class Corpus(object):
+    """
+    Synthetic benchmark document generator. Each document exercises one
+    feature, the 'mixed' document interleaves the 'mix' features. The
+    documents are reproducible: the same size and mix always generate the
+    same documents.
+    """
+
+    def __init__(self, size=5000, mix=FEATURES):
+        self.size = size            # Approximate lines per document.
+        self.mix = mix              # Features in the mixed document.
+        self.random = None
+        self.ids = 0                # Number of generated anchors.
+        self.parts = 0              # Number of generated include files.
+        self.level = 0              # Current section level.
+        self.count = 0              # Included lines count.
+        self.dir = None
+        self.lines = {}             # Document lines (including includes).
+
+    def words(self, count):
+        return [self.random.choice(WORDS) for i in range(count)]
+
+    def sentence(self, words=None):
+        s = ' '.join(self.words(words or self.random.randint(6, 16)))
+        return s[0].upper() + s[1:] + '.'
+
+    def paragraph(self):
+        result = []
+        line = ''
+        for i in range(self.random.randint(3, 8)):
+            line = (line + ' ' + self.sentence()).strip()
+            if len(line) > 60:
+                result.append(line)
+                line = ''
+        if line:
+            result.append(line)
+        return result + ['']
+
+    def prose(self):
+        return self.paragraph()
+
+    def inline(self):
+        """A paragraph dense with quoted text and inline macros."""
+        quotes = ('*%s*', '_%s_', '`%s`', '+%s+', '^%s^', '~%s~', '#%s#',
+                  "'%s'", '**%s**', '__%s__', '``%s\'\'')
+        self.ids += 1
+        result = ['[[a%d]]' % self.ids]
+        words = []
+        for word in self.words(self.random.randint(40, 80)):
+            r = self.random.random()
+            if r < 0.35:
+                word = self.random.choice(quotes) % word
+            elif r < 0.40:
+                word = 'http://example.com/%s[%s]' % (word, word)
+            elif r < 0.45:
+                word = '<<a%d,%s>>' % (self.random.randint(1, self.ids), word)
+            elif r < 0.48:
+                word = 'footnote:[%s]' % ' '.join(self.words(5))
+            elif r < 0.51:
+                word = '((%s))' % word
+            elif r < 0.53:
+                word = 'image:images/%s.png[%s]' % (word, word)
+            elif r < 0.55:
+                word = '{%s}' % self.random.choice(('amp','lt','gt','nbsp'))
+            words.append(word)
+            if len(words) >= 8:
+                result.append(' '.join(words))
+                words = []
+        if words:
+            result.append(' '.join(words))
+        return result + ['']
+
+    def lists(self):
+        """Deeply nested bulleted, numbered and labeled lists."""
+        result = []
+        kind = self.random.choice(('*', '.', ':'))
+        for i in range(self.random.randint(10, 30)):
+            depth = self.random.randint(1, 5)
+            if kind == ':':
+                result.append('%s%s' % (' '.join(self.words(2)), ':'*(depth+1)))
+                result.append('  ' + self.sentence())
+            else:
+                result.append('%s %s' % (kind*depth, self.sentence()))
+            if self.random.random() < 0.1:
+                result += ['+'] + self.paragraph()[:-1]
+        return result + ['']
+
+    def tables(self):
+        """A big table."""
+        cols = self.random.randint(3, 8)
+        result = ['.%s' % self.sentence(4),
+            '[cols="%s",options="header"]' % ','.join(['1']*cols), '|===']
+        for i in range(self.random.randint(100, 300)):
+            result.append(' '.join(['|' + ' '.join(self.words(
+                    self.random.randint(1, 4))) for j in range(cols)]))
+        return result + ['|===', '']
+
+    def includes(self):
+        """An include macro for a generated file."""
+        self.parts += 1
+        fname = os.path.join('includes', 'part%04d.txt' % self.parts)
+        lines = self.paragraph() + self.paragraph()
+        self.write(fname, lines)
+        self.count += len(lines)
+        return ['include::%s[]' % fname, '']
+
+    def sections(self):
+        """A section title at a random level and a short body."""
+        level = self.random.randint(1, min(self.level + 1, 4))
+        self.level = level
+        result = ['%s %s' % ('='*(level+1), self.sentence(4)[:-1]), '']
+        return result + self.paragraph()[:3] + ['']
+
+    def filters(self):
+        """A listing block with the stub filter."""
+        result = ['[stub]', '-'*40]
+        for i in range(self.random.randint(3, 15)):
+            result.append('    ' + ' '.join(self.words(6)))
+        return result + ['-'*40, '']
+
+    def document(self, name):
+        """Return the lines of document name."""
+        self.random = random.Random(name)
+        self.ids = 0
+        self.level = 0
+        self.count = 0
+        if name == 'mixed':
+            features = self.mix
+        else:
+            features = (name,)
+        title = 'Benchmark %s document' % name
+        result = [title, '='*len(title), ':doctype: book', '']
+        while self.count + len(result) < self.size:
+            # Top-level section.
+            if 'sections' not in features:
+                title = self.sentence(4)[:-1]
+                result += [title, '-'*len(title), '']
+            for i in range(10):
+                feature = self.random.choice(features)
+                result += getattr(self, feature)()
+        return result
+
+    def write(self, fname, lines):
+        fname = os.path.join(self.dir, fname)
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        f = open(fname, 'w')
+        try:
+            f.write('\n'.join(lines) + '\n')
+        finally:
+            f.close()
+
+    def generate(self, dir):
+        """Write the benchmark documents to directory dir."""
+        self.dir = dir
+        self.write('stubfilter.py', STUB_FILTER.split('\n'))
+        for name in DOCUMENTS:
+            lines = self.document(name)
+            self.write(name + '.txt', lines)
+            if name in ('filters', 'mixed'):
+                self.write(name + '.conf', STUB_FILTER_CONF.split('\n'))
+            self.lines[name] = self.count + len(lines)
+
+
+class Benchmark(object):
+
+    def __init__(self, baseline, runs=3, tolerance=10):
+        self.baseline_file = baseline
+        self.runs = runs
+        self.tolerance = tolerance
+        self.baseline = {}
+        self.results = {}
+        self.regressions = 0
+        self.failures = 0           # Number of failed conversions.
+        if os.path.isfile(baseline):
+            import json
+            f = open(baseline)
+            try:
+                self.baseline = json.load(f)
+            finally:
+                f.close()
+
+    def convert(self, infile, backend):
+        """
+        Convert infile, return (seconds,peak memory in MB). The peak memory
+        is None if it is not available, seconds is None if the conversion
+        failed.
+        """
+        outfile = os.path.splitext(infile)[0] + BACKEND_EXT[backend]
+        args = [sys.executable, asciidoc_py(), '-b', backend, '-o', outfile,
+                infile]
+        devnull = open(os.devnull, 'w')
+        try:
+            t = time.time()
+            p = subprocess.Popen(args, stdout=devnull, stderr=devnull)
+            if hasattr(os, 'wait4'):
+                status,rusage = os.wait4(p.pid, 0)[1:]
+                p.returncode = status
+                maxrss = rusage.ru_maxrss / 1024.0  # Kilobytes on Linux.
+                if sys.platform == 'darwin':
+                    maxrss = maxrss / 1024.0        # Bytes on Mac OS X.
+            else:
+                status = p.wait()
+                maxrss = None
+            t = time.time() - t
+        finally:
+            devnull.close()
+        if status != 0:
+            message('FAILED: %s' % ' '.join(args))
+            return None, maxrss
+        return t, maxrss
+
+    def compare(self, key, result):
+        """Return the baseline comparison column."""
+        base = self.baseline.get(key)
+        if not base:
+            return ''
+        if base['lines'] != result['lines']:
+            return 'baseline size differs'
+        rate = 100.0 * (result['rate'] - base['rate']) / base['rate']
+        s = '%+6.1f%%' % rate
+        regression = rate < -self.tolerance
+        if result['maxrss'] and base['maxrss']:
+            mem = 100.0 * (result['maxrss'] - base['maxrss']) / base['maxrss']
+            s += ' %+6.1f%%' % mem
+            regression = regression or mem > self.tolerance
+        if regression:
+            self.regressions += 1
+            s += ' REGRESSION'
+        return s
+
+    def run(self, corpus, documents, backends):
+        """Time and report conversion of documents to backends."""
+        print('%-10s %-8s %7s %8s %9s %8s %s' % ('DOCUMENT', 'BACKEND',
+            'LINES', 'SECONDS', 'LINES/S', 'PEAK MB', 'RATE/MEMORY CHANGE'))
+        for name in documents:
+            infile = os.path.join(corpus.dir, name + '.txt')
+            lines = corpus.lines[name]
+            for backend in backends:
+                times = []
+                maxrss = None
+                for i in range(self.runs):
+                    t,m = self.convert(infile, backend)
+                    if t is None:
+                        break
+                    times.append(t)
+                    if m is not None:
+                        maxrss = max(maxrss, m)
+                key = '%s-%s' % (name, backend)
+                if len(times) < self.runs:
+                    # Failed conversions are regressions, not results.
+                    self.failures += 1
+                    self.regressions += 1
+                    print('%-10s %-8s %7d %8s %9s %8s %s' % (name, backend,
+                        lines, '-', '-', '-', 'FAILED'))
+                    continue
+                t = min(times)
+                result = {'lines': lines, 'seconds': t, 'rate': lines / t,
+                        'maxrss': maxrss}
+                self.results[key] = result
+                if maxrss is None:
+                    maxrss = '-'
+                else:
+                    maxrss = '%.1f' % maxrss
+                print('%-10s %-8s %7d %8.3f %9.0f %8s %s' % (name, backend,
+                    lines, t, result['rate'], maxrss,
+                    self.compare(key, result)))
+        if self.failures:
+            print('TOTAL FAILURES: %d' % self.failures)
+        if self.regressions:
+            print('TOTAL REGRESSIONS: %d' % self.regressions)
+
+    def update(self):
+        """Write the results to the baseline file."""
+        import json
+        self.baseline.update(self.results)
+        f = open(self.baseline_file, 'w')
+        try:
+            json.dump(self.baseline, f, indent=1, sort_keys=True)
+            f.write('\n')
+        finally:
+            f.close()
+        print('WRITING: %s' % self.baseline_file)
+
+
+def usage(msg=None):
+    if msg:
+        message(msg + '\n')
+    message(USAGE)
+
+
+if __name__ == '__main__':
+    # Process command line options.
+    import getopt
+    try:
+        opts,args = getopt.getopt(sys.argv[1:], 'b:d:m:r:s:t:',
+            ['baseline=','dir=','mix=','runs=','size=','tolerance='])
+    except getopt.GetoptError:
+        usage('illegal command options')
+        sys.exit(1)
+    if len(args) == 0:
+        usage()
+        sys.exit(1)
+    baseline = os.path.join(os.path.dirname(sys.argv[0]), 'benchasciidoc.json')
+    dir = None
+    mix = FEATURES
+    runs = 3
+    size = 5000
+    tolerance = 10
+    try:
+        for o,v in opts:
+            if o in ('-b','--baseline'):
+                baseline = v
+            if o in ('-d','--dir'):
+                dir = v
+            if o in ('-m','--mix'):
+                mix = tuple(v.split(','))
+                for feature in mix:
+                    if feature not in FEATURES:
+                        raise ValueError('illegal FEATURE: %s' % feature)
+            if o in ('-r','--runs'):
+                runs = int(v)
+            if o in ('-s','--size'):
+                size = int(v)
+            if o in ('-t','--tolerance'):
+                tolerance = float(v)
+    except ValueError, e:
+        usage(str(e))
+        sys.exit(1)
+    cmd = args[0]
+    corpus = Corpus(size, mix)
+    if cmd == 'generate':
+        if len(args) != 2:
+            usage('DIR required')
+            sys.exit(1)
+        corpus.generate(args[1])
+        for name in DOCUMENTS:
+            print('%s: %d lines' % (os.path.join(args[1], name + '.txt'),
+                corpus.lines[name]))
+    elif cmd in ('run','update'):
+        documents = DOCUMENTS
+        backends = BACKENDS
+        for arg in args[1:3]:
+            if arg in DOCUMENTS:
+                documents = (arg,)
+            elif arg in BACKENDS:
+                backends = (arg,)
+            else:
+                message('illegal DOCUMENT or BACKEND: %s' % arg)
+                sys.exit(1)
+        tmpdir = None
+        if dir is None:
+            dir = tmpdir = tempfile.mkdtemp(prefix='benchasciidoc-')
+        try:
+            corpus.generate(dir)
+            benchmark = Benchmark(baseline, runs, tolerance)
+            benchmark.run(corpus, documents, backends)
+            if cmd == 'update':
+                benchmark.update()
+        finally:
+            if tmpdir:
+                shutil.rmtree(tmpdir)
+        if benchmark.failures or (cmd == 'run' and benchmark.regressions):
+            sys.exit(1)
+    else:
+        usage('illegal COMMAND: %s' % cmd)
+        sys.exit(1)
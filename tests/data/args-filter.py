@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+'''
+A filter that writes its command-line arguments to stdout followed by the
+input lines (used by inprocess-filter-test.txt).
+'''
+import os, sys
+
+def asciidoc_filter(lines, args):
+    sys.stdout.write('args: %s%s' % (' | '.join(args), os.linesep))
+    return lines
+
+if __name__ == '__main__':
+    lines = sys.stdin.read().split(os.linesep)
+    for line in asciidoc_filter(lines, sys.argv[1:]):
+        sys.stdout.write(line + os.linesep)
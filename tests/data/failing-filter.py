@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+'''
+An in-process filter that always fails (used by
+inprocess-filter-test.txt).
+'''
+
+def asciidoc_filter(lines, args):
+    raise ValueError('deliberate filter failure')
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(asciidoc_filter(sys.stdin.readlines(), sys.argv[1:]))